@@ -3,3 +3,7 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.AutoField'
     name = 'core'
+
+    def ready(self):
+        # Connect the page publishing signal receivers, and register checks.
+        from core import checks, signals  # noqa: F401
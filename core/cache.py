@@ -0,0 +1,156 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+import contextvars
+import hashlib
+import re
+import time
+
+from oim_cms import metrics
+
+
+GENERATION_KEY = 'core:generation:{}'
+CHANGED_KEY = 'core:changed:{}'
+RENDER_KEY = 'core:render:{}'
+# The CSRF token is the only per-visitor value in an anonymous page render, so
+# it is swapped out for a placeholder before the HTML is stored.
+CSRF_INPUT_RE = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+CSRF_PLACEHOLDER = '__csrf_token__'
+# The stamps read together (one round trip to the cache) when any is needed.
+STAMP_NAMES = ('pages', 'sites')
+# The stamps read during the current request, keyed by (template, name), so
+# that each is read from the cache once per request (see the request signal
+# receivers in core.signals). None outside requests.
+_generations = contextvars.ContextVar('generations', default=None)
+
+
+def memoise_generations():
+    _generations.set({})
+
+
+def forget_generations():
+    _generations.set(None)
+
+
+def seed_stamp(template):
+    # Generations are seeded in nanoseconds, so that they are distinct from
+    # (and later than) any value a lost stamp was bumped to.
+    return time.time_ns() if template == GENERATION_KEY else int(time.time())
+
+
+def read_stamps(name):
+    """Read the generation and change time of ``name`` and of every name in
+    STAMP_NAMES with one ``get_many``, seeding those that are missing. Never
+    returns None for a stamp.
+    """
+    keys = {
+        (template, stamp_name): template.format(stamp_name)
+        for template in (GENERATION_KEY, CHANGED_KEY)
+        for stamp_name in dict.fromkeys(STAMP_NAMES + (name,))
+    }
+    values = cache.get_many(keys.values())
+    missing = [stamp for stamp, key in keys.items() if key not in values]
+    if missing:
+        for template, stamp_name in missing:
+            cache.add(keys[template, stamp_name], seed_stamp(template), None)
+        values.update(cache.get_many([keys[stamp] for stamp in missing]))
+    # A cache that stores nothing (DummyCache) still gets a fresh value from
+    # the clock, so that whatever is keyed on the stamp is never reused.
+    return {
+        stamp: values[key] if values.get(key) is not None else seed_stamp(stamp[0])
+        for stamp, key in keys.items()
+    }
+
+
+def get_stamp(template, name):
+    memo = _generations.get()
+    if memo is not None and (template, name) in memo:
+        return memo[template, name]
+    stamps = read_stamps(name)
+    if memo is not None:
+        for stamp, value in stamps.items():
+            memo.setdefault(stamp, value)
+    return stamps[template, name]
+
+
+def get_generation(name):
+    """Return the current value of a named generation stamp.
+
+    Cache keys that embed a generation are implicitly invalidated when the
+    stamp is bumped. A missing stamp is seeded from the clock, so a stamp that
+    is evicted never reverts to a value used by older keys.
+    """
+    return get_stamp(GENERATION_KEY, name)
+
+
+def bump_generation(name):
+    """Advance a named generation stamp, invalidating any keys built on it.
+    """
+    changed_at = int(time.time())
+    cache.set(CHANGED_KEY.format(name), changed_at, None)
+    key = GENERATION_KEY.format(name)
+    try:
+        generation = cache.incr(key)
+    except ValueError:
+        generation = time.time_ns()
+        cache.set(key, generation, None)
+    memo = _generations.get()
+    if memo is not None:
+        memo[GENERATION_KEY, name] = generation
+        memo[CHANGED_KEY, name] = changed_at
+    return generation
+
+
+def get_changed_at(name):
+    """Return the time (in whole seconds since the epoch) at which a named
+    generation stamp was last bumped. A missing time is seeded from the clock,
+    so it is never earlier than the true time of the last change.
+    """
+    return get_stamp(CHANGED_KEY, name)
+
+
+def make_key(template, *parts):
+    """Hash arbitrary key parts (which may include user input such as the
+    ``?template=`` override) into a key that is safe for every cache backend.
+    """
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return template.format(digest)
+
+
+def is_render_cacheable(request):
+    """Only anonymous GET/HEAD requests without render-altering query
+    parameters (other than ``template``) share a cached render.
+    """
+    if not settings.RENDER_CACHE_TIMEOUT:
+        return False
+    if request.method not in ('GET', 'HEAD') or getattr(request, 'is_preview', False):
+        return False
+    if not set(request.GET).issubset({'template'}):
+        return False
+    user = getattr(request, 'user', None)
+    return not (user and user.is_authenticated)
+
+
+def get_render_cache_key(page, request, template_name):
+    site = getattr(request, 'site', None)
+    return make_key(
+        RENDER_KEY, get_generation('pages'), page.pk, page.live_revision_id,
+        template_name, site.pk if site else None)
+
+
+def get_cached_response(request, key):
+    html = cache.get(key)
+    if html is None:
+        metrics.inc('oim_cms_cache_requests_total', cache='render', result='miss')
+        return None
+    metrics.inc('oim_cms_cache_requests_total', cache='render', result='hit')
+    return HttpResponse(html.replace(CSRF_PLACEHOLDER, get_token(request)))
+
+
+def cache_response(key, response):
+    if response.status_code != 200:
+        return
+    html = CSRF_INPUT_RE.sub(
+        r'\g<1>{}\g<2>'.format(CSRF_PLACEHOLDER), response.content.decode(response.charset))
+    cache.set(key, html, settings.RENDER_CACHE_TIMEOUT)
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.checks import Error, Warning, register
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """The generation stamps that invalidate rendered pages, menus, site and
+    page URL lookups (see core.cache) live in the default cache, so it must
+    be shared by every worker process and pod.
+    """
+    if settings.CACHES['default']['BACKEND'] not in settings.PER_PROCESS_CACHE_BACKENDS:
+        return []
+    message = 'The default cache is per process or stores nothing, so publishing and site changes are not shared.'
+    hint = 'Set CACHE_BACKEND to a shared backend, such as memcached (or the default DatabaseCache in development).'
+    if settings.DEBUG:
+        return [Warning(message, hint=hint, id='core.W001')]
+    return [Error(message, hint=hint, id='core.E001')]
+
+
+MEMORY_BACKEND_PREFIXES = ('django.core.cache.backends.memcached.', 'django_redis.')
+
+
+@register(deploy=True)
+def check_memory_cache(app_configs, **kwargs):
+    """Every request reads the generation stamps and most read rendered pages
+    and fragments from the default cache, so in production it must be
+    memcached or redis; a DatabaseCache costs a query per read.
+    """
+    if settings.CACHES['default']['BACKEND'].startswith(MEMORY_BACKEND_PREFIXES):
+        return []
+    return [Error(
+        'The default cache is not memcached or redis, so each cache read is a database query or is not shared.',
+        hint='Set CACHE_BACKEND to django.core.cache.backends.memcached.PyMemcacheCache and CACHE_LOCATION '
+             'to the memcached host:port.',
+        id='core.E002')]
@@ -0,0 +1,70 @@
+"""
+Validators (ETag and Last-Modified) for conditional GET requests.
+
+A rendered page depends on other pages through menus, breadcrumbs, included
+content and content lists, so page and search validators are derived from
+the 'pages' generation stamp (bumped by any publish, unpublish, move or
+delete) together with everything specific to the request that affects the
+render: the page revision, template choice, query string, site and user.
+"""
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from wagtail.search.utils import normalise_query_string
+import hashlib
+
+from core.cache import get_changed_at, get_generation
+
+
+def make_etag(*parts):
+    """Return a strong ETag for the given parts.
+    """
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return '"{}"'.format(digest)
+
+
+def get_user_id(request):
+    user = getattr(request, 'user', None)
+    return user.pk if user and user.is_authenticated else None
+
+
+def get_page_validators(page, request, template_name):
+    """Return (etag, last_modified) for a request for a Content page.
+    """
+    site = getattr(request, 'site', None)
+    etag = make_etag(
+        'page', get_generation('pages'), page.pk, page.live_revision_id, template_name,
+        request.GET.urlencode(), site.pk if site else None, get_user_id(request))
+    last_modified = get_changed_at('pages')
+    if page.last_published_at:
+        last_modified = max(last_modified, int(page.last_published_at.timestamp()))
+    return etag, last_modified
+
+
+def get_search_validators(request, query_string):
+    """Return (etag, last_modified) for a request for search results, which
+    change only when the search index does (that is, when pages do).
+    """
+    etag = make_etag(
+        'search', get_generation('pages'), normalise_query_string(query_string or ''),
+        request.GET.get('page', ''), get_user_id(request))
+    return etag, get_changed_at('pages')
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def get_not_modified(request, etag, last_modified=None):
+    """Return a 304 (Not Modified) response carrying the validators if the
+    request's If-None-Match or If-Modified-Since headers match them, or None
+    if the full response is needed.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    response = set_validators(HttpResponse(), etag, last_modified)
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified, response=response)
+    return None if conditional is response else conditional
@@ -0,0 +1,57 @@
+from django.db import IntegrityError, models, transaction
+import json
+
+
+def get_revision_url_path(revision):
+    """Return the lower-cased url_path recorded in a revision's content.
+    """
+    try:
+        url_path = json.loads(revision.content_json).get('url_path')
+    except ValueError:
+        return None
+    return url_path.lower() if url_path else None
+
+
+def index_revision(revision):
+    """Point the draft index entry for a new revision's url_path at it.
+    """
+    from core.models import DraftPath
+    url_path = get_revision_url_path(revision)
+    if not url_path:
+        return
+    fields = {'page_id': revision.page_id, 'revision': revision, 'created_at': revision.created_at}
+    updated = DraftPath.objects.filter(url_path=url_path).update(
+        revision_count=models.F('revision_count') + 1, **fields)
+    if not updated:
+        try:
+            with transaction.atomic():
+                DraftPath.objects.create(url_path=url_path, revision_count=1, **fields)
+        except IntegrityError:
+            # Created concurrently by another request.
+            DraftPath.objects.filter(url_path=url_path).update(
+                revision_count=models.F('revision_count') + 1, **fields)
+
+
+def rebuild_index(revisions, DraftPath=None):
+    """Replace the draft index with entries built from ``revisions``.
+    Returns the number of url_paths indexed. Migrations pass their
+    historical DraftPath model.
+    """
+    if DraftPath is None:
+        from core.models import DraftPath
+    entries = {}
+    for revision in revisions.order_by('created_at', 'id').iterator():
+        url_path = get_revision_url_path(revision)
+        if not url_path:
+            continue
+        entry = entries.get(url_path)
+        if entry is None:
+            entry = entries[url_path] = DraftPath(url_path=url_path)
+        entry.page_id = revision.page_id
+        entry.revision_id = revision.pk
+        entry.created_at = revision.created_at
+        entry.revision_count += 1
+    with transaction.atomic():
+        DraftPath.objects.all().delete()
+        DraftPath.objects.bulk_create(entries.values(), batch_size=500)
+    return len(entries)
@@ -0,0 +1,86 @@
+from django.db import models
+from django.template.loader import render_to_string
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
+import re
+import threading
+
+from core.richtext import reference_batch
+
+
+EXCERPT_TEMPLATE = 'core/tags/include_content.html'
+# Number of words kept in the plain-text summary.
+SUMMARY_WORDS = 60
+# Pages whose excerpt is being rendered by this thread; a page that lists
+# itself (via content_list) would otherwise recurse without end.
+_rendering = threading.local()
+
+
+def render_excerpt(page):
+    """Return the excerpt HTML and plain-text summary for a Content page.
+    """
+    pages = getattr(_rendering, 'pages', None)
+    if pages is None:
+        pages = _rendering.pages = set()
+    pages.add(page.pk)
+    try:
+        with reference_batch(page):
+            html = render_to_string(EXCERPT_TEMPLATE, {'self': page, 'embed': True})
+    finally:
+        pages.discard(page.pk)
+    text = re.sub(r'\s+', ' ', strip_tags(html)).strip()
+    return html, Truncator(text).words(SUMMARY_WORDS)
+
+
+def update_excerpt(page):
+    """Render and store the excerpt for the live revision of a Content page.
+    """
+    from core.models import ContentExcerpt
+    html, text = render_excerpt(page)
+    excerpt, created = ContentExcerpt.objects.update_or_create(
+        page=page, defaults={'revision_id': page.live_revision_id, 'html': html, 'text': text})
+    return excerpt
+
+
+def build_excerpt(page):
+    """Render the excerpt for the live revision of a Content page without
+    storing it.
+    """
+    from core.models import ContentExcerpt
+    html, text = render_excerpt(page)
+    return ContentExcerpt(page=page, revision_id=page.live_revision_id, html=html, text=text)
+
+
+def get_excerpt(page):
+    """Return the stored excerpt for a Content page, or one rendered (but not
+    stored) if it is missing or out of date with the live revision; excerpts
+    are only stored on publish and by the generate_excerpts command, so views
+    never write. Pages fetched with ``select_related('excerpt')`` cost no
+    further queries when up to date.
+    """
+    from core.models import ContentExcerpt
+    if page.pk in getattr(_rendering, 'pages', ()):
+        return ContentExcerpt(page=page)
+    try:
+        excerpt = page.excerpt
+    except ContentExcerpt.DoesNotExist:
+        excerpt = None
+    if excerpt is None or excerpt.revision_id != page.live_revision_id:
+        excerpt = build_excerpt(page)
+    return excerpt
+
+
+def backfill_excerpts(refresh=False):
+    """Render the excerpts of live Content pages that have none, or whose
+    excerpt is out of date with the live revision (or every live page, if
+    ``refresh``). Returns the number rendered.
+    """
+    from core.models import Content
+    pages = Content.objects.live().select_related('excerpt')
+    if not refresh:
+        pages = pages.exclude(excerpt__revision_id=models.F('live_revision_id'))
+    count = 0
+    for page in pages.iterator():
+        update_excerpt(page)
+        count += 1
+    return count
@@ -0,0 +1,220 @@
+"""
+Pre-rendering of live Content pages to static HTML files.
+
+Each page is written to STATIC_EXPORT_ROOT/<hostname>_<port><path>index.html
+for every site that serves it (sites are matched on both), so that a web
+server can return it without touching Django. With the default root (under
+MEDIA_ROOT, which the nginx deployment already mounts), a location such as
+this serves exported pages to GET and HEAD requests and passes everything
+else through, taking the port from the ingress's X-Forwarded-Port:
+
+    map $http_x_forwarded_port $site_port {
+        default $http_x_forwarded_port;
+        "" $server_port;
+    }
+
+    location / {
+        error_page 418 = @django;
+        if ($request_method !~ ^(GET|HEAD)$) {
+            return 418;
+        }
+        try_files /media/export/${host}_${site_port}${uri}index.html @django;
+    }
+
+With STATIC_EXPORT_ON_PUBLISH, the background worker (run_background_tasks)
+runs a changed-only export after pages are published.
+
+Pages are rendered as an anonymous visitor. Pages with view restrictions
+(password, login or group) are not exported, and nor are pages with a form
+that is posted: their form would need a CSRF token and cookie, which a
+static file can't provide. The tokens in other pages are left blank.
+"""
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import connections
+from django.test import RequestFactory
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from multiprocessing import Pool
+from wagtail.core.models import PageLogEntry, Site
+import os
+import re
+
+from core.cache import CSRF_INPUT_RE
+from core.includes import get_includers
+
+
+STATE_FILE = '.last-export'
+INDEX_FILE = 'index.html'
+POST_FORM_RE = re.compile(r'<form\b[^>]*\bmethod=["\']?post', re.IGNORECASE)
+# Logged actions that change menus, breadcrumbs or URLs across the site, and
+# so make an incremental export unsafe.
+STRUCTURAL_ACTIONS = (
+    'wagtail.move', 'wagtail.reorder', 'wagtail.delete', 'wagtail.rename',
+    'wagtail.unpublish', 'wagtail.unpublish.scheduled',
+)
+
+
+def get_sites():
+    return list(Site.objects.select_related('root_page'))
+
+
+def get_export_paths(url_path, sites=None):
+    """Return (site, path, file) for each site that serves the page with the
+    given url_path.
+    """
+    paths = []
+    for site in sites if sites is not None else get_sites():
+        root_path = site.root_page.url_path
+        if not url_path.startswith(root_path):
+            continue
+        path = url_path[len(root_path) - 1:]
+        filename = os.path.join(
+            settings.STATIC_EXPORT_ROOT, '{}_{}'.format(site.hostname, site.port), *path.strip('/').split('/'),
+            INDEX_FILE)
+        paths.append((site, path, os.path.normpath(filename)))
+    return paths
+
+
+def render_page(page, site, path):
+    """Return the HTML of a live page as served to an anonymous visitor, or
+    None if it is not an ordinary 200 response or has a form that is posted.
+    """
+    request = RequestFactory().get(path, HTTP_HOST=site.hostname, SERVER_PORT=site.port)
+    request.site = site
+    request.user = AnonymousUser()
+    response = page.serve(request)
+    if response.status_code != 200:
+        return None
+    if hasattr(response, 'render'):
+        response.render()
+    html = response.content.decode(response.charset)
+    if POST_FORM_RE.search(html):
+        return None
+    return CSRF_INPUT_RE.sub(r'\g<1>\g<2>', html)
+
+
+def _write(filename, html):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(html)
+    os.replace(tmp, filename)
+
+
+def export_page(page, sites=None):
+    """Write the static files of a live, public Content page, returning their
+    names. The files of a site in which it can't be exported are removed.
+    """
+    written = []
+    for site, path, filename in get_export_paths(page.url_path, sites):
+        html = render_page(page, site, path)
+        if html is not None:
+            _write(filename, html)
+            written.append(filename)
+        elif os.path.exists(filename):
+            os.remove(filename)
+    return written
+
+
+def remove_page(url_path, subtree=False):
+    """Remove the static files of the page with the given url_path, and
+    those of its descendants if ``subtree`` is set.
+    """
+    for site, path, filename in get_export_paths(url_path):
+        if os.path.exists(filename):
+            os.remove(filename)
+        if subtree:
+            prune(os.path.dirname(filename), keep=())
+
+
+def prune(root, keep):
+    """Remove exported files under ``root`` that are not in ``keep``, and any
+    directories left empty.
+    """
+    keep = set(keep)
+    for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+        if INDEX_FILE in filenames and os.path.join(dirpath, INDEX_FILE) not in keep:
+            os.remove(os.path.join(dirpath, INDEX_FILE))
+        if dirpath != settings.STATIC_EXPORT_ROOT and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+
+
+def _export_chunk(pks):
+    from core.models import Content
+    sites = get_sites()
+    written = []
+    for page in Content.objects.live().public().filter(pk__in=pks):
+        written += export_page(page, sites)
+    return written
+
+
+def export_pages(pks, processes=None, chunk_size=20):
+    """Render the Content pages with the given pks across a pool of worker
+    processes, returning the names of the files written.
+    """
+    pks = list(pks)
+    chunks = [pks[i:i + chunk_size] for i in range(0, len(pks), chunk_size)]
+    if processes == 1 or len(chunks) < 2:
+        return [filename for chunk in chunks for filename in _export_chunk(chunk)]
+    # Forked workers must open their own database connections.
+    connections.close_all()
+    with Pool(processes) as pool:
+        return [filename for written in pool.imap_unordered(_export_chunk, chunks) for filename in written]
+
+
+def get_last_export():
+    try:
+        with open(os.path.join(settings.STATIC_EXPORT_ROOT, STATE_FILE)) as f:
+            return parse_datetime(f.read().strip())
+    except OSError:
+        return None
+
+
+def set_last_export(when):
+    os.makedirs(settings.STATIC_EXPORT_ROOT, exist_ok=True)
+    _write(os.path.join(settings.STATIC_EXPORT_ROOT, STATE_FILE), when.isoformat())
+
+
+def get_changed_pages(since):
+    """Return the pks of live Content pages whose static files may have
+    changed since ``since``, or None if everything must be exported.
+
+    A page's render includes menus, included snippets and content lists, so
+    besides pages published since then this covers the pages that include
+    them and every page with a content list. Structural changes, and
+    publishing a page shown in menus or with children (whose titles and
+    URLs appear elsewhere), require a full export.
+    """
+    from core.models import Content
+    if PageLogEntry.objects.filter(timestamp__gt=since, action__in=STRUCTURAL_ACTIONS).exists():
+        return None
+    changed = list(Content.objects.live().public().filter(last_published_at__gt=since))
+    if any(page.show_in_menus or page.numchild for page in changed):
+        return None
+    pks = set(page.pk for page in changed)
+    if changed:
+        for page in changed:
+            pks.update(includer.pk for includer in get_includers(page))
+        pks.update(Content.objects.live().public().filter(body__contains='"content_list"').values_list('pk', flat=True))
+    return pks
+
+
+def export_site(changed_only=False, processes=None):
+    """Export every live Content page, or only those changed since the last
+    export. A full export also removes the files of pages no longer live.
+    Pages with view restrictions are never exported. Returns the number of
+    files written.
+    """
+    from core.models import Content
+    started = timezone.now()
+    since = get_last_export() if changed_only else None
+    pks = get_changed_pages(since) if since else None
+    if pks is None:
+        pks = Content.objects.live().public().values_list('pk', flat=True)
+        written = export_pages(pks, processes)
+        prune(settings.STATIC_EXPORT_ROOT, written)
+    else:
+        written = export_pages(pks, processes)
+    set_last_export(started)
+    return len(written)
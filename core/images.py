@@ -0,0 +1,79 @@
+"""
+Eager generation of image renditions.
+
+Renditions for every registered rich text image format are generated soon
+after an image is saved, by the one background worker of the deployment (the
+run_background_tasks management command), so that Pillow never runs inside
+a page request. Saving an image bumps the 'images' generation stamp, which
+the worker polls. The generate_renditions management command backfills
+renditions for existing images.
+"""
+from django.db import connections
+from multiprocessing import Pool
+from wagtail.images import get_image_model
+from wagtail.images.formats import get_image_formats
+import logging
+
+
+LOGGER = logging.getLogger('cms')
+
+
+def get_filter_specs():
+    """Return the filter specs of the registered rich text image formats.
+    """
+    return sorted(set(image_format.filter_spec for image_format in get_image_formats()))
+
+
+def generate_renditions(image_ids):
+    """Create any missing renditions of the given images for the registered
+    formats, returning the number of images processed.
+    """
+    count = 0
+    for image in get_image_model().objects.filter(pk__in=image_ids):
+        for filter_spec in get_filter_specs():
+            try:
+                image.get_rendition(filter_spec)
+            except Exception:
+                LOGGER.exception('Could not generate the %s rendition of image %s', filter_spec, image.pk)
+        count += 1
+    return count
+
+
+def get_missing_rendition_images():
+    """Return the pks of images lacking a rendition for a registered format.
+    """
+    Image = get_image_model()
+    pks = set()
+    for filter_spec in get_filter_specs():
+        pks.update(Image.objects.exclude(renditions__filter_spec=filter_spec).values_list('pk', flat=True))
+    return sorted(pks)
+
+
+def generate_missing_renditions(attempted=None):
+    """Generate the renditions of images that lack one for a registered
+    format, returning the number of images processed.
+
+    Images in ``attempted`` (a dict of pk to file name, updated in place) are
+    skipped unless their file has been replaced since, so that an image that
+    can't be rendered isn't retried on every run.
+    """
+    files = dict(get_image_model().objects.filter(
+        pk__in=get_missing_rendition_images()).values_list('pk', 'file'))
+    if attempted is not None:
+        files = {pk: name for pk, name in files.items() if attempted.get(pk) != name}
+        attempted.update(files)
+    return generate_renditions(sorted(files))
+
+
+def backfill_renditions(processes=None, chunk_size=20):
+    """Generate missing renditions across a pool of worker processes,
+    returning the number of images processed.
+    """
+    pks = get_missing_rendition_images()
+    chunks = [pks[i:i + chunk_size] for i in range(0, len(pks), chunk_size)]
+    if processes == 1 or len(chunks) < 2:
+        return sum(generate_renditions(chunk) for chunk in chunks)
+    # Forked workers must open their own database connections.
+    connections.close_all()
+    with Pool(processes) as pool:
+        return sum(pool.imap_unordered(generate_renditions, chunks))
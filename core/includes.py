@@ -0,0 +1,168 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from core.cache import get_generation, make_key
+from core.richtext import add_to_batch
+from oim_cms import metrics
+
+
+INCLUDE_KEY = 'core:include:{}'
+INCLUDE_TEMPLATE = 'core/tags/include_content.html'
+# Includes nested deeper than this are reported inline rather than rendered.
+MAX_INCLUDE_DEPTH = 8
+
+
+def get_include_slugs(body):
+    """Return the slugs referenced by the include_content blocks of a body.
+    """
+    if not body:
+        return []
+    return [block.value for block in body if block.block_type == 'include_content']
+
+
+def get_includers(page, seen=None):
+    """Yield the live Content pages that include ``page``, directly or
+    through nested include_content blocks.
+    """
+    from core.models import Content
+    seen = seen if seen is not None else {page.pk}
+    for includer in Content.objects.live().filter(body__contains=page.slug):
+        if includer.pk in seen or page.slug not in get_include_slugs(includer.body):
+            continue
+        seen.add(includer.pk)
+        yield includer
+        yield from get_includers(includer, seen)
+
+
+class IncludeResolver(object):
+    """Resolves include_content slugs to Content pages for one request.
+
+    Slugs are fetched in batches: each call to ``prefetch`` follows nested
+    includes transitively, costing one query per level of nesting rather than
+    one query per block.
+    """
+    def __init__(self):
+        self._pages = {}
+
+    def prefetch(self, slugs):
+        from core.models import Content
+        slugs = set(slugs) - set(self._pages)
+        while slugs:
+            found = {slug: [] for slug in slugs}
+            for page in Content.objects.filter(slug__in=slugs):
+                found[page.slug].append(page)
+            self._pages.update(found)
+            slugs = set(
+                slug for pages in found.values() for page in pages
+                for slug in get_include_slugs(page.body)) - set(self._pages)
+
+    def get(self, slug):
+        """Return the page for ``slug``, raising the same exceptions as
+        ``Content.objects.get(slug=slug)``.
+        """
+        from core.models import Content
+        self.prefetch([slug])
+        pages = self._pages[slug]
+        if not pages:
+            raise Content.DoesNotExist('Content matching query does not exist.')
+        if len(pages) > 1:
+            raise Content.MultipleObjectsReturned(
+                'get() returned more than one Content -- it returned {}!'.format(len(pages)))
+        return pages[0]
+
+
+def get_included_pages(page, resolver=None):
+    """Yield each page that ``page`` includes, directly or through nested
+    include_content blocks, once.
+    """
+    from core.models import Content
+    resolver = resolver or IncludeResolver()
+    seen = {page.slug}
+    slugs = get_include_slugs(page.body)
+    for depth in range(MAX_INCLUDE_DEPTH):
+        resolver.prefetch(slugs)
+        next_slugs = []
+        for slug in slugs:
+            if slug in seen:
+                continue
+            seen.add(slug)
+            try:
+                included = resolver.get(slug)
+            except (Content.DoesNotExist, Content.MultipleObjectsReturned):
+                continue
+            yield included
+            next_slugs += get_include_slugs(included.body)
+        if not next_slugs:
+            break
+        slugs = next_slugs
+
+
+def get_request_resolver(request, page=None):
+    """Return the resolver for a request, creating it (primed with the
+    includes of ``page``) on first use.
+    """
+    resolver = getattr(request, '_include_resolver', None)
+    if resolver is None:
+        resolver = IncludeResolver()
+        if hasattr(page, 'body'):
+            resolver.prefetch(get_include_slugs(page.body))
+        if request is not None:
+            request._include_resolver = resolver
+    return resolver
+
+
+def get_include_resolver(context):
+    """Return the resolver for the current request, creating it (primed with
+    the includes of the page being rendered) on first use.
+    """
+    return get_request_resolver(context.get('request'), context.get('self'))
+
+
+def render_include(context, slug):
+    """Render the body of the Content page with the given slug.
+
+    Fragments are cached per included page revision and site. Missing pages, include
+    cycles and excessive nesting are reported inline as an error.
+    """
+    page = context.get('self')
+    stack = context.get('include_stack') or ([page.slug] if hasattr(page, 'slug') else [])
+    errors = context.get('include_errors')
+    if errors is None:
+        errors = []
+    error = None
+    if slug in stack:
+        error = '{}: include cycle ({})'.format(slug, ' > '.join(stack + [slug]))
+    elif len(stack) > MAX_INCLUDE_DEPTH:
+        error = '{}: includes are nested more than {} deep'.format(slug, MAX_INCLUDE_DEPTH)
+    else:
+        try:
+            page = get_include_resolver(context).get(slug)
+        except Exception as e:
+            error = '{}: {}'.format(slug, e)
+    if error:
+        errors.append(error)
+        return render_to_string(INCLUDE_TEMPLATE, {'self': None, 'error': error})
+
+    # Links and page URLs in the fragment depend on the site it is served on.
+    request = context.get('request')
+    site = getattr(request, 'site', None)
+    key = make_key(
+        INCLUDE_KEY, get_generation('pages'), page.pk, page.live_revision_id, site.pk if site else None)
+    html = cache.get(key)
+    metrics.inc('oim_cms_cache_requests_total', cache='include', result='miss' if html is None else 'hit')
+    if html is None:
+        add_to_batch(page.body)
+        error_count = len(errors)
+        html = render_to_string(INCLUDE_TEMPLATE, {
+            'self': page,
+            'request': request,
+            'include_stack': stack + [slug],
+            'include_errors': errors,
+        })
+        # A fragment containing a nested error depends on where it was
+        # included from, so it isn't shared.
+        if len(errors) == error_count:
+            cache.set(key, html, settings.RENDER_CACHE_TIMEOUT)
+    return mark_safe(html)
@@ -0,0 +1,139 @@
+"""
+A database-backed queue for outbound email.
+
+Requests enqueue messages and return immediately; the send_queued_mail
+management command delivers them in batches over a single SMTP connection.
+Failed messages are retried with exponential backoff, and are marked dead
+after MAIL_QUEUE_MAX_ATTEMPTS. Messages that couldn't be sent because the
+SMTP server was unreachable or dropped the connection are retried without
+counting an attempt, so an outage doesn't exhaust the queue.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+import logging
+import smtplib
+
+
+LOGGER = logging.getLogger('cms')
+
+
+def enqueue_mail(subject, message, from_email, recipient_list, html_message=None):
+    """Queue an email for delivery, taking the same arguments as send_mail.
+    """
+    from core.models import OutboundMessage
+    return OutboundMessage.objects.create(
+        subject=subject, body=message, html_body=html_message or '', from_email=from_email,
+        recipients='\n'.join(recipient_list))
+
+
+def get_retry_delay(attempts):
+    """Return the delay before the next attempt after ``attempts`` failures.
+    """
+    delay = settings.MAIL_QUEUE_RETRY_DELAY * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, settings.MAIL_QUEUE_MAX_RETRY_DELAY))
+
+
+def claim_batch(size):
+    """Return up to ``size`` messages that are due for delivery, leasing them
+    so that concurrent workers don't send them too.
+    """
+    from core.models import OutboundMessage
+    now = timezone.now()
+    with transaction.atomic():
+        messages = list(
+            OutboundMessage.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboundMessage.QUEUED, next_attempt_at__lte=now)[:size])
+        OutboundMessage.objects.filter(pk__in=[message.pk for message in messages]).update(
+            next_attempt_at=now + timedelta(seconds=settings.MAIL_QUEUE_LEASE))
+    return messages
+
+
+def make_email(message, connection):
+    email = EmailMultiAlternatives(
+        message.subject, message.body, message.from_email, message.recipients.split('\n'),
+        connection=connection)
+    if message.html_body:
+        email.attach_alternative(message.html_body, 'text/html')
+    return email
+
+
+def is_connection_error(error):
+    """Return whether an error is the connection's rather than the message's.
+    SMTP errors are OSErrors too, so only those about the connection count.
+    """
+    if isinstance(error, (smtplib.SMTPConnectError, smtplib.SMTPServerDisconnected)):
+        return True
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def defer(messages, error):
+    """Retry messages after MAIL_QUEUE_RETRY_DELAY without counting an
+    attempt, as they failed for want of a connection.
+    """
+    from core.models import OutboundMessage
+    LOGGER.warning('Deferring %s queued emails: %s', len(messages), error)
+    OutboundMessage.objects.filter(pk__in=[message.pk for message in messages]).update(
+        last_error='{}: {}'.format(error.__class__.__name__, error),
+        next_attempt_at=timezone.now() + timedelta(seconds=settings.MAIL_QUEUE_RETRY_DELAY))
+
+
+def record_failure(message, error):
+    from core.models import OutboundMessage
+    message.attempts += 1
+    message.last_error = '{}: {}'.format(error.__class__.__name__, error)
+    if message.attempts >= settings.MAIL_QUEUE_MAX_ATTEMPTS:
+        message.status = OutboundMessage.DEAD
+        LOGGER.error('Giving up on queued email %s after %s attempts: %s', message.pk, message.attempts, error)
+    else:
+        message.next_attempt_at = timezone.now() + get_retry_delay(message.attempts)
+    message.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+
+def send_batch(size=None, connection=None):
+    """Send one batch of due messages over a single connection, returning the
+    number of (sent, failed) messages. Failed messages include those deferred
+    by a connection failure.
+    """
+    from core.models import OutboundMessage
+    messages = claim_batch(size or settings.MAIL_QUEUE_BATCH_SIZE)
+    if not messages:
+        return 0, 0
+    connection = connection or get_connection(fail_silently=False)
+    sent = failed = 0
+    try:
+        connection.open()
+    except Exception as e:
+        if is_connection_error(e):
+            # The server is unreachable, which is no fault of the messages.
+            defer(messages, e)
+        else:
+            # Such as a failed login: every message in the batch fails.
+            for message in messages:
+                record_failure(message, e)
+        return 0, len(messages)
+    try:
+        for index, message in enumerate(messages):
+            try:
+                make_email(message, connection).send()
+            except Exception as e:
+                if is_connection_error(e):
+                    # The connection broke: retry this and the rest of the
+                    # batch later.
+                    defer(messages[index:], e)
+                    failed += len(messages) - index
+                    break
+                record_failure(message, e)
+                failed += 1
+                # Reconnect for the next message, in case the connection broke.
+                connection.close()
+            else:
+                message.status = OutboundMessage.SENT
+                message.sent_at = timezone.now()
+                message.save(update_fields=['status', 'sent_at'])
+                sent += 1
+    finally:
+        connection.close()
+    return sent, failed
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from djqscsv import render_to_csv_response
+import time
+import tracemalloc
+
+from core.models import OutboundMessage
+from oim_cms.utils import iter_csv, iter_jsonl
+
+
+FIELDS = ('id', 'subject', 'from_email', 'recipients', 'status', 'attempts', 'created_at')
+
+
+def measure(iterable):
+    """Consume an export, returning (peak traced memory in MB, seconds, bytes).
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = sum(len(chunk) for chunk in iterable)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024.0 / 1024.0, elapsed, size
+
+
+class Command(BaseCommand):
+    help = ('Compares the peak memory of buffered (djqscsv) and streamed exports as the row count grows. '
+            'Rows are created in a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 50000])
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        self.stdout.write('{:>8} {:<10} {:>9} {:>8} {:>11}'.format('rows', 'export', 'peak MB', 'seconds', 'bytes'))
+        for rows in options['rows']:
+            with transaction.atomic():
+                now = timezone.now()
+                OutboundMessage.objects.bulk_create([
+                    OutboundMessage(
+                        subject='Benchmark message {}'.format(i), body='x' * 200, from_email='a@example.com',
+                        recipients='b@example.com', next_attempt_at=now)
+                    for i in range(rows)], batch_size=1000)
+                queryset = OutboundMessage.objects.values(*FIELDS)
+                exports = (
+                    ('djqscsv', lambda: render_to_csv_response(queryset, field_order=FIELDS).streaming_content),
+                    ('csv', lambda: iter_csv(queryset, FIELDS, options['chunk_size'])),
+                    ('jsonl', lambda: iter_jsonl(queryset, FIELDS, options['chunk_size'])),
+                )
+                for name, export in exports:
+                    peak, elapsed, size = measure(export())
+                    self.stdout.write('{:>8} {:<10} {:>9.1f} {:>8.2f} {:>11}'.format(rows, name, peak, elapsed, size))
+                transaction.set_rollback(True)
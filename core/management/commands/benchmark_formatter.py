@@ -0,0 +1,107 @@
+from django.core.management.base import BaseCommand
+import copy
+import time
+
+from oim_cms.utils import FieldsFormatter
+
+
+class LegacyFieldsFormatter(object):
+    """FieldsFormatter as it was before accessor plans, for comparison: every
+    lookup is split, and its strategy checked, for every field of every row.
+    """
+    def __init__(self, formatters):
+        self._formatters = formatters
+
+    def format(self, request, data):
+        for row in data:
+            for lookup, formatter in self._formatters.items():
+                if formatter:
+                    self.format_data(request, lookup, row, formatter)
+        return data
+
+    def format_data(self, request, lookup, data, formatter):
+        parts = lookup.split('.')
+        if not parts or not parts[0]:
+            return formatter(request, data)
+        part = parts[0]
+        remaining_lookup = '.'.join(parts[1:])
+        if hasattr(data, 'keys') and hasattr(data, '__getitem__'):
+            try:
+                value = data[part]
+                if remaining_lookup:
+                    self.format_data(request, remaining_lookup, value, formatter)
+                else:
+                    data[part] = formatter(request, value)
+            except:  # noqa: E722
+                pass
+        else:
+            try:
+                value = getattr(data, part)
+                if remaining_lookup:
+                    self.format_data(request, remaining_lookup, value, formatter)
+                else:
+                    setattr(data, part, formatter(request, value))
+            except:  # noqa: E722
+                pass
+        return data
+
+
+class Person(object):
+
+    def __init__(self, name, email):
+        self.name = name
+        self.email = email
+
+
+def format_upper(request, value):
+    return value.upper()
+
+
+def format_url(request, value):
+    return 'https://example.com/media/{}'.format(value)
+
+
+FORMATTERS = {
+    'photo': format_url,
+    'title': format_upper,
+    'person.name': format_upper,
+    'person.email': format_upper,
+    'location.address.city': format_upper,
+}
+
+
+def make_rows(count):
+    return [{
+        'id': i,
+        'title': 'title {}'.format(i),
+        'photo': 'photos/{}.jpg'.format(i),
+        'person': Person('person {}'.format(i), 'p{}@example.com'.format(i)),
+        'location': {'address': {'city': 'perth', 'street': '{} Hay St'.format(i)}},
+    } for i in range(count)]
+
+
+class Command(BaseCommand):
+    help = 'Compares FieldsFormatter against the previous implementation on list payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rows = make_rows(options['rows'])
+        results = {}
+        for name, formatter_class in (('legacy', LegacyFieldsFormatter), ('plans', FieldsFormatter)):
+            best = None
+            for i in range(options['repeat']):
+                data = copy.deepcopy(rows)
+                start = time.perf_counter()
+                formatter_class(FORMATTERS).format(None, data)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[name] = data
+            self.stdout.write('{:<8} {:>8.1f} ms ({} rows, best of {})'.format(
+                name, best * 1000, options['rows'], options['repeat']))
+        same = all(
+            vars(a.pop('person')) == vars(b.pop('person')) and a == b
+            for a, b in zip(results['legacy'], results['plans']))
+        self.stdout.write('Results identical: {}'.format(same))
@@ -0,0 +1,148 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.utils import timezone
+from wagtail.core.models import Site
+import django
+import json
+import logging
+import math
+import platform
+import statistics
+import time
+
+from core.cache import bump_generation
+from core.models import Content
+from core.search_hits import discard_hits
+from core.testing import QueryBudget, build_page_tree
+
+
+MISSING_PATH = '/benchmark-missing-page/'
+
+
+def get_depth(pages, breadth):
+    """Return the depth of tree with the given breadth that holds ``pages``.
+    """
+    depth, size = 0, 0
+    while size < pages:
+        depth += 1
+        size += breadth ** depth
+    return depth
+
+
+def summarise(latencies, queries, statuses):
+    latencies = sorted(latencies)
+    return {
+        'median_ms': round(statistics.median(latencies) * 1000, 2),
+        'p95_ms': round(latencies[max(0, int(math.ceil(len(latencies) * 0.95)) - 1)] * 1000, 2),
+        'queries_median': statistics.median(queries),
+        'queries_max': max(queries),
+        'statuses': sorted(set(statuses)),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Builds a synthetic page tree under the default site root and reports median and p95 '
+            'latency and query counts for each page template, search, the 404 handler and the '
+            'draft view, with cold and warm caches. The tree is created in a transaction that is '
+            'rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=200, help='Number of Content pages to create')
+        parser.add_argument('--breadth', type=int, default=5, help='Children per page')
+        parser.add_argument('--include-depth', type=int, default=3, help='Nesting of included snippets')
+        parser.add_argument('--iterations', type=int, default=20, help='Measured requests per target and mode')
+        parser.add_argument('--query', default='body', help='Search query string')
+        parser.add_argument('--output', help='Write the results to this file, as JSON')
+
+    def handle(self, *args, **options):
+        site = Site.objects.filter(is_default_site=True).select_related('root_page').first()
+        if site is None:
+            raise CommandError('No default site: run the migrations first')
+        started = timezone.now()
+        # Don't log every benchmarked 404.
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        try:
+            with transaction.atomic():
+                results = self.run(site, options)
+                transaction.set_rollback(True)
+        finally:
+            request_logger.setLevel(level)
+            # Cached renders may carry the rolled back pages (whose ids the
+            # database can reuse), so invalidate them.
+            bump_generation('pages')
+            discard_hits()
+        report = {
+            'started': started.isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'debug': settings.DEBUG,
+            'options': {key: options[key] for key in ('pages', 'breadth', 'include_depth', 'iterations', 'query')},
+            'results': results,
+        }
+        self.stdout.write('{:<32} {:<5} {:>9} {:>9} {:>8} {:>8}  {}'.format(
+            'target', 'cache', 'p50 ms', 'p95 ms', 'queries', 'max q', 'statuses'))
+        for target, modes in results.items():
+            for mode, result in modes.items():
+                self.stdout.write('{:<32} {:<5} {:>9.2f} {:>9.2f} {:>8} {:>8}  {}'.format(
+                    target, mode, result['median_ms'], result['p95_ms'], result['queries_median'],
+                    result['queries_max'], ','.join(str(status) for status in result['statuses'])))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+    def run(self, site, options):
+        pages = build_page_tree(
+            site.root_page, depth=get_depth(options['pages'], options['breadth']), breadth=options['breadth'],
+            tags=('news', 'benchmark'), prefix='benchmark', include_depth=options['include_depth'],
+            limit=options['pages'])
+        # The deepest first child, which includes snippets and lists pages.
+        page = Content.objects.get(pk=[p for p in pages if p.slug.endswith('-0')][-1].pk)
+        page.save_revision()  # An unpublished draft, for the draft view.
+        page_url = page.relative_url(site)
+        self.stdout.write('Created {} pages; sample page {}'.format(len(pages), page_url))
+
+        # Targets are (label, path, extra request headers for request i), each
+        # requested through the full middleware stack.
+        targets = [
+            ('page:{}'.format(name), '{}?template={}'.format(page_url, name), lambda i: {})
+            for name, label in Content._meta.get_field('template_filename').choices
+        ]
+        targets += [
+            ('search', '/search?q={}'.format(options['query']), lambda i: {}),
+            # Each request comes from a new address, so that 404 searches
+            # aren't cut short by the per-client search budget.
+            ('404', MISSING_PATH, lambda i: {'REMOTE_ADDR': '10.{}.{}.{}'.format(
+                i // 65536 % 256, i // 256 % 256, i % 256)}),
+            ('draft', '/draft{}'.format(page_url), lambda i: {}),
+        ]
+        client = Client(raise_request_exception=False, HTTP_HOST=site.hostname)
+        results = {}
+        counter = 0
+        for target, path, get_extra in targets:
+            results[target] = {}
+            for mode in ('cold', 'warm'):
+                latencies, queries, statuses = [], [], []
+                # Warm runs start with an unmeasured request to fill caches.
+                for i in range(options['iterations'] + (mode == 'warm')):
+                    counter += 1
+                    extra = get_extra(counter)
+                    if mode == 'cold':
+                        bump_generation('pages')
+                    budget = QueryBudget(locate=False)
+                    start = time.perf_counter()
+                    with budget:
+                        response = client.get(path, **extra)
+                    elapsed = time.perf_counter() - start
+                    discard_hits()
+                    if mode == 'warm' and i == 0:
+                        continue
+                    latencies.append(elapsed)
+                    queries.append(len(budget.queries) + len(budget.cache_queries))
+                    statuses.append(response.status_code)
+                results[target][mode] = summarise(latencies, queries, statuses)
+        return results
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from core.export import export_site
+
+
+class Command(BaseCommand):
+    help = 'Pre-renders live Content pages to static HTML files under STATIC_EXPORT_ROOT'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--changed', action='store_true',
+            help='Only export pages that may have changed since the last export')
+        parser.add_argument(
+            '--processes', type=int, default=None,
+            help='Number of worker processes (defaults to the number of CPUs)')
+
+    def handle(self, *args, **options):
+        count = export_site(changed_only=options['changed'], processes=options['processes'])
+        self.stdout.write(self.style.SUCCESS('Wrote {} static pages'.format(count)))
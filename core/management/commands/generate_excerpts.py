@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from core.excerpts import backfill_excerpts
+
+
+class Command(BaseCommand):
+    help = 'Renders the stored excerpts of live Content pages that are missing or out of date'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true', dest='refresh',
+            help='Re-render every excerpt, e.g. to pick up changes to the pages they include')
+
+    def handle(self, *args, **options):
+        count = backfill_excerpts(refresh=options['refresh'])
+        self.stdout.write(self.style.SUCCESS('Rendered {} excerpts'.format(count)))
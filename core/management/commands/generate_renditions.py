@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from core.images import backfill_renditions
+
+
+class Command(BaseCommand):
+    help = 'Generates missing image renditions for the registered rich text image formats'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=None,
+            help='Number of worker processes (defaults to the number of CPUs)')
+
+    def handle(self, *args, **options):
+        count = backfill_renditions(processes=options['processes'])
+        self.stdout.write(self.style.SUCCESS('Generated renditions for {} images'.format(count)))
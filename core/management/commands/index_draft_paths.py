@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from wagtail.core.models import PageRevision
+
+from core.drafts import rebuild_index
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds the url_path index used to look up drafts at /draft/<path> (which is built by '
+            'the migrations and kept current as revisions are saved)')
+
+    def handle(self, *args, **options):
+        count = rebuild_index(PageRevision.objects.only('id', 'page_id', 'created_at', 'content_json'))
+        self.stdout.write(self.style.SUCCESS('Indexed {} url paths'.format(count)))
@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+import statistics
+import time
+import urllib.error
+import urllib.request
+
+
+def fetch(url, timeout):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = None
+    return status, time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = ('Sends concurrent requests to running servers and reports throughput and latency, '
+            'e.g. to compare the WSGI and ASGI modes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help='URLs to request (each is tested in turn)')
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--requests', type=int, default=500, help='Requests per URL')
+        parser.add_argument('--timeout', type=float, default=30)
+
+    def handle(self, *args, **options):
+        self.stdout.write('{:>8} {:>8} {:>8} {:>8} {:>7}  {}'.format('req/s', 'p50 ms', 'p95 ms', 'max ms', 'errors', 'url'))
+        for url in options['urls']:
+            with ThreadPoolExecutor(options['concurrency']) as pool:
+                start = time.perf_counter()
+                results = list(pool.map(lambda i: fetch(url, options['timeout']), range(options['requests'])))
+                elapsed = time.perf_counter() - start
+            latencies = sorted(duration * 1000 for status, duration in results)
+            errors = sum(1 for status, duration in results if status is None or status >= 500)
+            self.stdout.write('{:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>7}  {}'.format(
+                len(results) / elapsed, statistics.median(latencies),
+                latencies[int(len(latencies) * 0.95) - 1], latencies[-1], errors, url))
@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+import json
+import os
+import subprocess
+import sys
+
+
+# Boots the application in a fresh interpreter (run with -X importtime) as a
+# gunicorn worker would see it, and prints timings as JSON on stdout.
+BOOT_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+from oim_cms.wsgi import application
+report = {"load": time.perf_counter() - started, "warm_up": [], "requests": []}
+options = json.loads(sys.argv[1])
+if options["warm_up"]:
+    from oim_cms.warmup import warm_up
+    report["warm_up"] = warm_up()
+from django.test import Client
+client = Client(raise_request_exception=False, **({"HTTP_HOST": options["host"]} if options["host"] else {}))
+for url in options["urls"]:
+    timings = []
+    for i in range(2):
+        started = time.perf_counter()
+        response = client.get(url)
+        timings.append(time.perf_counter() - started)
+    report["requests"].append([url, response.status_code] + timings)
+print(json.dumps(report))
+'''
+
+
+def parse_importtime(output):
+    """Return [(module, cumulative seconds)] for the top-level imports in
+    the output of ``python -X importtime``.
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not name[1:].startswith(' '):
+            imports.append((name.strip(), int(cumulative_us) / 1e6))
+    return imports
+
+
+class Command(BaseCommand):
+    help = 'Reports the import, warm-up and first-request times of a freshly booted application'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', action='append', dest='urls',
+            help='URL to request (twice) after booting; may be repeated (default: /)')
+        parser.add_argument('--host', default='', help='Host header for the requests')
+        parser.add_argument(
+            '--no-warm-up', action='store_false', dest='warm_up',
+            help='Skip the warm-up stage, as a worker would without a preloading master')
+        parser.add_argument('--top', type=int, default=15, help='Number of slowest imports to list')
+        parser.add_argument('--output', help='Also write the report to this file, as JSON')
+
+    def handle(self, *args, **options):
+        child_options = {'urls': options['urls'] or ['/'], 'host': options['host'], 'warm_up': options['warm_up']}
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', BOOT_SCRIPT, json.dumps(child_options)],
+            cwd=settings.BASE_DIR, env=dict(os.environ), capture_output=True, text=True)
+        if process.returncode:
+            raise CommandError('Boot failed:\n{}'.format(process.stderr[-4000:]))
+        report = json.loads(process.stdout.strip().splitlines()[-1])
+        imports = parse_importtime(process.stderr)
+        report['imports'] = sorted(imports, key=lambda item: item[1], reverse=True)[:options['top']]
+        report['import_total'] = sum(seconds for name, seconds in imports)
+
+        self.stdout.write('Load application: {:.3f}s'.format(report['load']))
+        self.stdout.write('Imports (whole run): {:.3f}s'.format(report['import_total']))
+        self.stdout.write('Slowest top-level imports:')
+        for name, seconds in report['imports']:
+            self.stdout.write('  {:8.3f}s  {}'.format(seconds, name))
+        if report['warm_up']:
+            self.stdout.write('Warm-up: {:.3f}s'.format(sum(seconds for name, seconds in report['warm_up'])))
+            for name, seconds in report['warm_up']:
+                self.stdout.write('  {:8.3f}s  {}'.format(seconds, name))
+        self.stdout.write('Requests (first, second):')
+        for url, status, first, second in report['requests']:
+            self.stdout.write('  {:8.3f}s {:8.3f}s  {} {}'.format(first, second, status, url))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
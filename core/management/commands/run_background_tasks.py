@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import time
+
+from core.cache import get_generation
+from core.export import export_site
+from core.images import generate_missing_renditions
+
+
+class Command(BaseCommand):
+    help = ('Generates the renditions of newly saved images and (with STATIC_EXPORT_ON_PUBLISH) re-exports '
+            'changed pages, outside the server processes')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep polling for new work instead of exiting once it is done')
+        parser.add_argument(
+            '--interval', type=float, default=settings.BACKGROUND_TASKS_POLL_INTERVAL,
+            help='Seconds to wait between polls (with --loop)')
+
+    def handle(self, *args, **options):
+        # Images whose renditions were attempted, so that failures aren't
+        # retried until their file is replaced.
+        attempted = {}
+        images_seen = export_seen = None
+        while True:
+            # Saving an image bumps the 'images' stamp (see core.signals); the
+            # first pass picks up images saved while no worker was running.
+            images_generation = get_generation('images')
+            if images_generation != images_seen:
+                images_seen = images_generation
+                count = generate_missing_renditions(attempted)
+                if count:
+                    self.stdout.write('Generated renditions for {} images'.format(count))
+            # As does publishing, unpublishing or moving a page the 'export'
+            # stamp, with STATIC_EXPORT_ON_PUBLISH.
+            if settings.STATIC_EXPORT_ON_PUBLISH:
+                export_generation = get_generation('export')
+                if export_generation != export_seen:
+                    export_seen = export_generation
+                    count = export_site(changed_only=True, processes=1)
+                    self.stdout.write('Wrote {} static pages'.format(count))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import time
+
+from core.mail import send_batch
+
+
+class Command(BaseCommand):
+    help = 'Sends queued outbound email, in batches over one SMTP connection each'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.MAIL_QUEUE_BATCH_SIZE,
+            help='Number of messages to send per SMTP connection')
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep polling for new messages instead of exiting once the queue is drained')
+        parser.add_argument(
+            '--interval', type=float, default=settings.MAIL_QUEUE_POLL_INTERVAL,
+            help='Seconds to wait between polls of an empty queue (with --loop)')
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+        while True:
+            sent, failed = send_batch(options['batch_size'])
+            total_sent += sent
+            total_failed += failed
+            if sent or failed:
+                self.stdout.write('Sent {}, failed {}'.format(sent, failed))
+            if sent:
+                continue
+            # The queue is empty, or a whole batch failed (e.g. SMTP is down,
+            # and the messages will be retried after their backoff).
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Sent {} messages ({} failed)'.format(total_sent, total_failed)))
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.13 on 2026-10-18 07:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailcore', '0066_collection_management_permissions'),
+        ('core', '0002_contentexcerpt'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DraftPath',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_path', models.TextField(unique=True)),
+                ('created_at', models.DateTimeField()),
+                ('revision_count', models.PositiveIntegerField(default=0)),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wagtailcore.page')),
+                ('revision', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wagtailcore.pagerevision')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+from core.drafts import rebuild_index
+
+
+def index_draft_paths(apps, schema_editor):
+    # Indexes the revisions saved before the index existed; later revisions
+    # are indexed as they are saved.
+    PageRevision = apps.get_model('wagtailcore', 'PageRevision')
+    rebuild_index(
+        PageRevision.objects.only('id', 'page_id', 'created_at', 'content_json'),
+        apps.get_model('core', 'DraftPath'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_outboundmessage'),
+    ]
+
+    operations = [
+        migrations.RunPython(index_draft_paths, migrations.RunPython.noop),
+    ]
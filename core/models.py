@@ -1,18 +1,22 @@
-from django.conf import settings
 from django.db import models
 from django.http import HttpResponseRedirect
 from django.utils import timezone
 from modelcluster.fields import ParentalKey
 from modelcluster.contrib.taggit import ClusterTaggableManager
-import os
 from taggit.models import TaggedItemBase
 from wagtail.admin.edit_handlers import FieldPanel, StreamFieldPanel
 from wagtail.core import blocks
-from wagtail.core.models import Page
+from wagtail.core.models import Page, PageRevision
 from wagtail.core.fields import StreamField
 from wagtail.images.formats import Format, register_image_format
 from wagtail.search import index
 
+from core.cache import cache_response, get_cached_response, get_render_cache_key, is_render_cacheable
+from core.conditional import get_not_modified, get_page_validators, set_validators
+from core.includes import get_included_pages, get_request_resolver
+from core.richtext import reference_batch
+from core.search import get_body_text, get_included_text
+
 
 '''To add a new size format use the following format
    register_image_format(Format('name', 'label', 'class_names', 'filter_spec'))
@@ -68,19 +72,120 @@ class Content(Page):
         FieldPanel('template_filename')
     ]
 
+    # The body is indexed as clean text per block type rather than as raw
+    # StreamField JSON, with headings weighted above body text, and the text
+    # of included pages weighted below it.
     search_fields = Page.search_fields + [
-        index.SearchField('body'),
+        index.SearchField('get_search_headings', boost=1.5),
+        index.SearchField('get_search_text'),
+        index.SearchField('get_search_included_text', boost=0.5),
         index.FilterField('url_path'),
     ]
 
+    def get_search_headings(self):
+        return get_body_text(self.body, ('heading',))
+
+    def get_search_text(self):
+        return get_body_text(self.body, ('rich_text', 'raw'))
+
+    def get_search_included_text(self):
+        return get_included_text(self)
+
     def serve(self, request):
         if 'draft' in request.GET:
             return HttpResponseRedirect('/admin/pages/{}/view_draft/'.format(self.pk))
-        response = super(Content, self).serve(request)
-        if 'embed' in request.GET:
-            with open(os.path.join(settings.MEDIA_ROOT, 'images', self.slug + '.html')) as output:
-                output.write(response.content)
+        template = self.get_template(request)
+        # Label request metrics by template, without letting arbitrary
+        # ?template= values create new labels.
+        known = [name for name, label in self._meta.get_field('template_filename').choices]
+        request.metrics_label = 'page:{}'.format(
+            template.split('/', 1)[-1] if template.split('/', 1)[-1] in known else 'other')
+        validators = None
+        if request.method in ('GET', 'HEAD') and not getattr(request, 'is_preview', False):
+            validators = get_page_validators(self, request, template)
+            response = get_not_modified(request, *validators)
+            if response is not None:
+                return response
+        cache_key = None
+        response = None
+        if is_render_cacheable(request):
+            cache_key = get_render_cache_key(self, request, template)
+            response = get_cached_response(request, cache_key)
+        if response is None:
+            # Render within a batch, so that the pages, documents and images
+            # referenced by rich text are fetched together.
+            included = get_included_pages(self, get_request_resolver(request, self))
+            with reference_batch(self, included, memoise=not getattr(request, 'is_preview', False)):
+                response = super(Content, self).serve(request)
+                if hasattr(response, 'render'):
+                    response.render()
+            if cache_key:
+                cache_response(cache_key, response)
+        if validators and response.status_code == 200:
+            set_validators(response, *validators)
         return response
 
     class Meta:
         ordering = ('date',)
+
+
+class ContentExcerpt(models.Model):
+    """The rendered excerpt of a Content page, generated once per published
+    revision for use in content lists.
+
+    Content that the page includes or lists is rendered as it was when the
+    page was published; run ``generate_excerpts --all`` to refresh it.
+    """
+    page = models.OneToOneField(Content, on_delete=models.CASCADE, related_name='excerpt')
+    revision = models.ForeignKey(PageRevision, null=True, on_delete=models.SET_NULL, related_name='+')
+    html = models.TextField(blank=True)
+    text = models.TextField(blank=True)
+
+    def __str__(self):
+        return str(self.page)
+
+
+class DraftPath(models.Model):
+    """Maps a (lower-cased) url_path recorded in page revisions to the most
+    recent revision saved with that path, for the /draft/<path> lookup.
+    """
+    url_path = models.TextField(unique=True)
+    page = models.ForeignKey(Page, on_delete=models.CASCADE, related_name='+')
+    revision = models.ForeignKey(PageRevision, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField()
+    revision_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.url_path
+
+
+class OutboundMessage(models.Model):
+    """An email waiting to be sent (or given up on) by the send_queued_mail
+    management command.
+    """
+    QUEUED = 'queued'
+    SENT = 'sent'
+    DEAD = 'dead'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (SENT, 'Sent'),
+        (DEAD, 'Dead'),
+    )
+    subject = models.TextField()
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=254)
+    recipients = models.TextField(help_text='One address per line')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('next_attempt_at', 'id')
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return self.subject
@@ -0,0 +1,105 @@
+from django.core.cache import cache
+from wagtail.core.models import Page
+import copy
+
+from core.cache import get_generation, make_key
+from core.page_urls import get_page_url
+from oim_cms import metrics
+
+
+MENU_KEY = 'core:menu:{}'
+ANCESTORS_KEY = 'core:ancestors:{}'
+
+
+class MenuItem(object):
+    """A lightweight, cacheable stand-in for a live, in-menu page, carrying
+    everything that the menu templates need.
+    """
+    def __init__(self, page, url):
+        self.pk = self.id = page.pk
+        self.title = page.title
+        self.path = page.path
+        self.url = url
+        self.show_dropdown = False
+        self.active = False
+
+    def __str__(self):
+        return self.title
+
+
+def build_menu_tree(request, root):
+    """Fetch every live, in-menu page below ``root`` in a single query and
+    return a dict mapping each parent's treebeard path to its ordered menu
+    items.
+    """
+    tree = {}
+    pages = Page.objects.descendant_of(root).live().in_menu().order_by('path')
+    for page in pages:
+        tree.setdefault(page.path[:-Page.steplen], []).append(MenuItem(page, get_page_url(page, request)))
+    for menuitems in tree.values():
+        for menuitem in menuitems:
+            menuitem.show_dropdown = menuitem.path in tree
+    return tree
+
+
+def get_menu_tree(request):
+    """Return the menu tree for the request's site, building it on the first
+    request after any page is published, unpublished or moved. The tree is
+    read from the cache once per request, however many menus render.
+    """
+    site = getattr(request, 'site', None)
+    if site is None:
+        return {}
+    tree = getattr(request, '_menu_tree', None)
+    if tree is not None:
+        return tree
+    key = make_key(MENU_KEY, get_generation('pages'), site.pk, site.root_page_id)
+    tree = cache.get(key)
+    metrics.inc('oim_cms_cache_requests_total', cache='menu', result='miss' if tree is None else 'hit')
+    if tree is None:
+        tree = build_menu_tree(request, site.root_page)
+        cache.set(key, tree, None)
+    request._menu_tree = tree
+    return tree
+
+
+def get_menu_children(request, parent):
+    """Return the menu items below ``parent`` (a page or a menu item).
+    """
+    return get_menu_tree(request).get(parent.path, [])
+
+
+def mark_active(menuitems, calling_page, request=None):
+    """Return copies of ``menuitems`` flagged as active when the calling page
+    sits beneath them. The cached items are shared and are never modified.
+    """
+    # We don't directly check if calling_page is None since the template
+    # engine can pass an empty string to calling_page
+    # if the variable passed as calling_page does not exist.
+    calling_url = get_page_url(calling_page, request) if calling_page else None
+    marked = []
+    for menuitem in menuitems:
+        menuitem = copy.copy(menuitem)
+        menuitem.active = bool(calling_url and menuitem.url) and calling_url.startswith(menuitem.url)
+        marked.append(menuitem)
+    return marked
+
+
+def get_ancestors(page):
+    """Return the pages from the top of the site tree down to ``page``
+    (inclusive), excluding the tree root, as used for breadcrumbs.
+
+    All ancestors are fetched in one query using the treebeard materialised
+    path, and memoised per page revision.
+    """
+    if not page:
+        return []
+    if not page.pk:
+        # An unsaved page (e.g. a preview) can't be memoised.
+        return list(Page.objects.ancestor_of(page).filter(depth__gt=1).order_by('path')) + [page]
+    key = make_key(ANCESTORS_KEY, get_generation('pages'), page.pk, page.live_revision_id, page.path)
+    ancestors = cache.get(key)
+    if ancestors is None:
+        ancestors = list(Page.objects.ancestor_of(page).filter(depth__gt=1).order_by('path'))
+        cache.set(key, ancestors, None)
+    return ancestors + [page]
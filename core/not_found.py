@@ -0,0 +1,97 @@
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+import difflib
+import os
+import threading
+import time
+
+from core.cache import get_generation, make_key
+from core.page_urls import get_path_url
+
+
+BUDGET_KEY = 'core:404-budget:{}'
+_lock = threading.Lock()
+# The slug index and negative cache are held per process.
+_index = {'generation': None, 'slugs': {}}
+_missing = OrderedDict()
+
+
+def get_slug_index():
+    """Return a dict of slug -> url_paths for every live, non-snippet
+    Content page, rebuilt once per 'pages' generation.
+    """
+    from core.models import Content
+    generation = get_generation('pages')
+    if _index['generation'] != generation:
+        slugs = {}
+        pages = Content.objects.live().exclude(url_path__startswith='/home/snippets/')
+        for slug, url_path in pages.values_list('slug', 'url_path'):
+            slugs.setdefault(slug.lower(), set()).add(url_path)
+        _index.update(generation=generation, slugs=slugs)
+    return _index['slugs']
+
+
+def normalise_segment(segment):
+    return os.path.splitext(segment)[0].lower()
+
+
+def find_redirect(request):
+    """Return the URL of the page that the missing request path most likely
+    refers to, or None.
+
+    Each path segment (last first) is looked up as an exact slug, then the
+    last segment is fuzzy-matched against all slugs. Ambiguous matches are
+    ignored.
+    """
+    slugs = get_slug_index()
+    segments = [normalise_segment(segment) for segment in request.path.split('/') if segment]
+    for segment in reversed(segments):
+        url_paths = slugs.get(segment)
+        if url_paths and len(url_paths) == 1:
+            return get_path_url(next(iter(url_paths)), request)
+    if segments:
+        matches = difflib.get_close_matches(segments[-1], slugs, n=2, cutoff=settings.NOT_FOUND_MATCH_CUTOFF)
+        if len(matches) == 1 and len(slugs[matches[0]]) == 1:
+            return get_path_url(next(iter(slugs[matches[0]])), request)
+    return None
+
+
+def is_known_missing(path):
+    key = (get_generation('pages'), path)
+    with _lock:
+        if key in _missing:
+            _missing.move_to_end(key)
+            return True
+    return False
+
+
+def remember_missing(path):
+    """Record that a path resolved to nothing, evicting the least recently
+    seen paths beyond NOT_FOUND_CACHE_SIZE.
+    """
+    with _lock:
+        _missing[(get_generation('pages'), path)] = True
+        while len(_missing) > settings.NOT_FOUND_CACHE_SIZE:
+            _missing.popitem(last=False)
+
+
+def get_client_ip(request):
+    # The rightmost X-Forwarded-For entry is the one added by the proxy in
+    # front of the application; those to its left are sent by the client.
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+    return forwarded.split(',')[-1].strip() or request.META.get('REMOTE_ADDR', '')
+
+
+def allow_search(request):
+    """Return True while the client is within its budget of 404 searches for
+    the current NOT_FOUND_SEARCH_WINDOW.
+    """
+    window = settings.NOT_FOUND_SEARCH_WINDOW
+    key = make_key(BUDGET_KEY, get_client_ip(request), int(time.time() // window))
+    cache.add(key, 0, window)
+    try:
+        used = cache.incr(key)
+    except ValueError:
+        return True
+    return used <= settings.NOT_FOUND_SEARCH_BUDGET
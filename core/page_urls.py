@@ -0,0 +1,100 @@
+"""
+Public URLs of pages, from a per-process map.
+
+Wagtail derives a page's URL from its url_path and the site root paths on
+every use of ``page.url`` or ``{% pageurl %}``, at the cost of a cache read
+and a URL reverse each time. Here the URL for each (url_path, current site)
+pair is computed once per worker process and kept until the 'sites'
+generation changes.
+
+A page's URL depends only on its url_path, which changes when the page is
+moved or its slug is changed, and on the sites, whose changes (including to
+their root pages) bump 'sites'. So entries never go stale, and the map
+grows only with the number of pages (times the number of sites).
+"""
+from django.conf import settings
+from django.urls import NoReverseMatch, reverse
+from wagtail.core.models import Page, Site
+import threading
+
+from core.cache import get_generation
+
+
+_lock = threading.Lock()
+# URLs are held per process, keyed by (url_path, current site pk), and
+# discarded whenever the 'sites' generation changes.
+_map = {'generation': None, 'roots': None, 'urls': {}}
+
+
+def get_url_map(request=None):
+    """Return the map for the current 'sites' generation, which is read once
+    per request.
+    """
+    generation = getattr(request, '_sites_generation', None)
+    if generation is None:
+        generation = get_generation('sites')
+        if request is not None:
+            request._sites_generation = generation
+    with _lock:
+        if _map['generation'] != generation:
+            _map.update(generation=generation, roots=None, urls={})
+        return _map
+
+
+def get_roots(url_map):
+    if url_map['roots'] is None:
+        # Wagtail's list, in its order of preference.
+        url_map['roots'] = [tuple(root[:3]) for root in Site.get_site_root_paths()]
+    return url_map['roots']
+
+
+def compute_url(roots, url_path, site_id=None):
+    """Return the URL of the page with the given url_path as seen from the
+    site with pk ``site_id``, as Page.get_url does: relative if the page is
+    in that site (or there is only one site), and absolute otherwise.
+    """
+    possible = [root for root in roots if url_path.startswith(root[1])]
+    if not possible:
+        return None
+    page_site_id, root_path, root_url = next((root for root in possible if root[0] == site_id), possible[0])
+    try:
+        page_path = reverse('wagtail_serve', args=(url_path[len(root_path):],))
+    except NoReverseMatch:
+        return None
+    if not getattr(settings, 'WAGTAIL_APPEND_SLASH', True) and page_path != '/':
+        page_path = page_path.rstrip('/')
+    if page_site_id == site_id or len(set(root[0] for root in roots)) == 1:
+        return page_path
+    return root_url + page_path
+
+
+def get_page_url(page, request=None, site=None):
+    """Return the public URL of a page as seen from ``site`` (by default the
+    request's site), or None if it isn't in any site.
+    """
+    return get_path_url(page.url_path, request, site)
+
+
+def get_path_url(url_path, request=None, site=None):
+    """As get_page_url, for the page with the given url_path.
+    """
+    if site is None:
+        site = getattr(request, 'site', None)
+    url_map = get_url_map(request)
+    key = (url_path or '', site.pk if site else None)
+    urls = url_map['urls']
+    if key not in urls:
+        urls[key] = compute_url(get_roots(url_map), *key)
+    return urls[key]
+
+
+def prime_url_map():
+    """Compute the URLs of every live page as seen from each site.
+    """
+    url_map = get_url_map()
+    roots = get_roots(url_map)
+    sites = [site_id for site_id, root_path, root_url in roots]
+    for url_path in Page.objects.live().values_list('url_path', flat=True):
+        for site_id in sites:
+            url_map['urls'][(url_path, site_id)] = compute_url(roots, url_path, site_id)
+    return len(url_map['urls'])
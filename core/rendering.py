@@ -0,0 +1,71 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+import json
+
+from core.cache import get_generation, make_key
+from oim_cms import metrics
+
+
+BLOCK_KEY = 'core:block:{}'
+# Only rich text (which expands references to pages, documents and images) is
+# worth a cache read; other blocks render from their value directly.
+CACHED_BLOCK_TYPES = ('rich_text',)
+# Blocks rendered by core/tags/include_content.html itself.
+TEMPLATE_BLOCK_TYPES = ('include_content', 'content_list')
+
+
+def render_block_html(block):
+    """Render a single StreamField block of a Content body to HTML.
+    """
+    if block.block_type == 'heading':
+        return format_html('<h1>{}</h1>', block.value)
+    elif block.block_type == 'rich_text':
+        return block.value.__html__()
+    return str(block)
+
+
+def get_block_cache_key(block):
+    """Key a block's rendered HTML on a hash of its type and value, so that
+    identical blocks share a fragment across revisions and pages.
+
+    Rich text that references pages, documents or images renders their
+    current URLs, so those blocks are also keyed on the 'pages' generation.
+    """
+    source = json.dumps(block.block.get_prep_value(block.value), sort_keys=True)
+    parts = [block.block_type, source]
+    if block.block_type == 'rich_text' and ('linktype=' in source or 'embedtype=' in source):
+        parts.append(get_generation('pages'))
+    return make_key(BLOCK_KEY, *parts)
+
+
+def render_blocks(body):
+    """Return (block, html) pairs for the blocks of a Content body.
+
+    Rich text fragments are read from the block cache with one ``get_many``
+    and the misses stored with one ``set_many``; headings and raw HTML are
+    cheaper to render than to fetch. The html of include_content and
+    content_list blocks is None, as the template renders them.
+    """
+    blocks = list(body or ())
+    keys = {
+        index: get_block_cache_key(block)
+        for index, block in enumerate(blocks) if block.block_type in CACHED_BLOCK_TYPES
+    }
+    cached = cache.get_many(keys.values()) if keys else {}
+    missed = {}
+    rendered = []
+    for index, block in enumerate(blocks):
+        html = None
+        if index in keys:
+            html = cached.get(keys[index])
+            metrics.inc('oim_cms_cache_requests_total', cache='block', result='miss' if html is None else 'hit')
+            if html is None:
+                html = missed[keys[index]] = str(render_block_html(block))
+        elif block.block_type not in TEMPLATE_BLOCK_TYPES:
+            html = render_block_html(block)
+        rendered.append((block, None if html is None else mark_safe(html)))
+    if missed:
+        cache.set_many(missed, settings.RENDER_CACHE_TIMEOUT)
+    return rendered
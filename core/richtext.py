@@ -0,0 +1,212 @@
+"""
+Batched expansion of the page links, document links and images in rich text.
+
+Wagtail expands each reference in rich text separately, costing one or two
+queries per link or image. While a Content page renders, a ReferenceBatch
+holds every reference in the rich text of its body and of the pages it
+includes. The handlers registered in core/wagtail_hooks.py resolve them from
+the batch, whose first lookup fetches them all in a few bulk queries.
+
+The expanded HTML of each reference is memoised per page revision (and
+'pages' generation), so later renders of the same revision resolve their
+references with a single cache read.
+"""
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.html import escape
+from wagtail.core.models import Page
+from wagtail.core.rich_text.pages import PageLinkHandler
+from wagtail.core.rich_text.rewriters import FIND_A_TAG, FIND_EMBED_TAG, extract_attrs
+from wagtail.documents import get_document_model
+from wagtail.documents.rich_text import DocumentLinkHandler
+from wagtail.images import get_image_model
+from wagtail.images.formats import get_image_format
+from wagtail.images.models import Filter
+from wagtail.images.rich_text import ImageEmbedHandler
+from wagtail.images.shortcuts import get_rendition_or_not_found
+import contextvars
+
+from core.cache import get_generation, make_key
+from core.images import get_filter_specs
+from core.page_urls import get_page_url
+from oim_cms import metrics
+
+
+REFERENCES_KEY = 'core:references:{}'
+_batch = contextvars.ContextVar('reference_batch', default=None)
+
+
+def get_references(body):
+    """Yield (kind, pk) for the page links, document links and images in the
+    rich text blocks of a body.
+    """
+    for block in body or ():
+        if block.block_type != 'rich_text':
+            continue
+        source = block.value.source
+        for attr_string in FIND_A_TAG.findall(source):
+            attrs = extract_attrs(attr_string)
+            if attrs.get('linktype') in ('page', 'document') and attrs.get('id', '').isdigit():
+                yield attrs['linktype'], int(attrs['id'])
+        for attr_string in FIND_EMBED_TAG.findall(source):
+            attrs = extract_attrs(attr_string)
+            if attrs.get('embedtype') == 'image' and attrs.get('id', '').isdigit():
+                yield 'image', int(attrs['id'])
+
+
+class ReferenceBatch(object):
+    """The objects referenced by the rich text being rendered.
+
+    Bodies are added without querying; the first lookup of an object not yet
+    loaded fetches every pending reference: pages (one query, plus one per
+    page type), documents, and images with their renditions.
+    """
+    def __init__(self, memo=None):
+        self.memo = memo or {}
+        self.changed = False
+        self._pending = {'page': set(), 'document': set(), 'image': set()}
+        self._objects = {'page': {}, 'document': {}, 'image': {}}
+        self._renditions = {}
+
+    def add(self, body):
+        for kind, pk in get_references(body):
+            if pk not in self._objects[kind]:
+                self._pending[kind].add(pk)
+
+    def fetch(self):
+        fetchers = {'page': self.fetch_pages, 'document': self.fetch_documents, 'image': self.fetch_images}
+        for kind, pks in self._pending.items():
+            if pks:
+                found = fetchers[kind](pks)
+                self._objects[kind].update((pk, found.get(pk)) for pk in pks)
+                self._pending[kind] = set()
+
+    def fetch_pages(self, pks):
+        return {page.pk: page for page in Page.objects.filter(pk__in=pks).specific()}
+
+    def fetch_documents(self, pks):
+        return get_document_model().objects.in_bulk(pks)
+
+    def fetch_images(self, pks):
+        Image = get_image_model()
+        images = Image.objects.in_bulk(pks)
+        for rendition in Image.get_rendition_model().objects.filter(image__in=images, filter_spec__in=get_filter_specs()):
+            rendition.image = images[rendition.image_id]
+            self._renditions[(rendition.image_id, rendition.filter_spec, rendition.focal_point_key)] = rendition
+        return images
+
+    def get(self, kind, pk):
+        """Return the referenced object, or None if it doesn't exist.
+        """
+        if pk not in self._objects[kind]:
+            self._pending[kind].add(pk)
+            self.fetch()
+        return self._objects[kind][pk]
+
+    def get_rendition(self, image, filter_spec):
+        key = (image.pk, filter_spec, Filter(spec=filter_spec).get_cache_key(image))
+        if key not in self._renditions:
+            self._renditions[key] = get_rendition_or_not_found(image, filter_spec)
+        return self._renditions[key]
+
+    def expand(self, kind, attrs, expand):
+        """Return the memoised HTML for a reference, calling ``expand`` to
+        produce it on a miss.
+        """
+        key = '{}:{}'.format(kind, ':'.join('{}={}'.format(*item) for item in sorted(attrs.items())))
+        html = self.memo.get(key)
+        if html is None:
+            html = self.memo[key] = expand(self, attrs)
+            self.changed = True
+        return html
+
+
+def get_references_key(page):
+    return make_key(REFERENCES_KEY, get_generation('pages'), page.pk, page.live_revision_id)
+
+
+@contextmanager
+def reference_batch(page, included=(), memoise=True):
+    """Batch the reference lookups of rich text rendered within the block,
+    starting with those in the bodies of ``page`` and the ``included`` pages.
+
+    ``memoise`` must be false when ``page`` isn't its live revision (as in a
+    preview).
+    """
+    key = get_references_key(page) if memoise and settings.RENDER_CACHE_TIMEOUT else None
+    memo = cache.get(key) if key else None
+    if key:
+        metrics.inc('oim_cms_cache_requests_total', cache='references', result='miss' if memo is None else 'hit')
+    batch = ReferenceBatch(memo)
+    if memo is None:
+        batch.add(page.body)
+        for included_page in included:
+            batch.add(included_page.body)
+    token = _batch.set(batch)
+    try:
+        yield batch
+    finally:
+        _batch.reset(token)
+        if key and batch.changed:
+            cache.set(key, batch.memo, settings.RENDER_CACHE_TIMEOUT)
+
+
+def add_to_batch(body):
+    """Add the references in ``body`` to the current batch, if any.
+    """
+    batch = _batch.get()
+    if batch is not None:
+        batch.add(body)
+
+
+def expand_page_link(batch, attrs):
+    page = batch.get('page', int(attrs['id']))
+    if page is None:
+        return '<a>'
+    return '<a href="%s">' % escape(get_page_url(page) or '')
+
+
+def expand_document_link(batch, attrs):
+    document = batch.get('document', int(attrs['id']))
+    if document is None:
+        return '<a>'
+    return '<a href="%s">' % escape(document.url)
+
+
+def expand_image(batch, attrs):
+    image = batch.get('image', int(attrs['id']))
+    if image is None:
+        return '<img alt="">'
+    image_format = get_image_format(attrs['format'])
+    # As Format.image_to_html, but with the batched rendition.
+    extra_attributes = {'alt': attrs.get('alt', '')}
+    if image_format.classnames:
+        extra_attributes['class'] = image_format.classnames
+    return batch.get_rendition(image, image_format.filter_spec).img_tag(extra_attributes)
+
+
+class BatchedHandlerMixin(object):
+    """Expands references from the current ReferenceBatch, if there is one,
+    and as Wagtail does otherwise.
+    """
+    expand_from_batch = None
+
+    @classmethod
+    def expand_db_attributes(cls, attrs):
+        batch = _batch.get()
+        if batch is None or not attrs.get('id', '').isdigit():
+            return super().expand_db_attributes(attrs)
+        return batch.expand(cls.identifier, attrs, cls.expand_from_batch)
+
+
+class BatchedPageLinkHandler(BatchedHandlerMixin, PageLinkHandler):
+    expand_from_batch = staticmethod(expand_page_link)
+
+
+class BatchedDocumentLinkHandler(BatchedHandlerMixin, DocumentLinkHandler):
+    expand_from_batch = staticmethod(expand_document_link)
+
+
+class BatchedImageEmbedHandler(BatchedHandlerMixin, ImageEmbedHandler):
+    expand_from_batch = staticmethod(expand_image)
@@ -0,0 +1,163 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.html import escape, format_html
+from django.utils.safestring import mark_safe
+from wagtail.search import index
+from wagtail.search.utils import normalise_query_string
+import html
+import math
+import re
+
+from core.cache import get_generation, make_key
+from core.excerpts import build_excerpt
+from core.includes import get_included_pages, get_includers
+from oim_cms import metrics
+
+
+COUNT_KEY = 'core:search-count:{}'
+SCRIPT_RE = re.compile(r'<(script|style)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+TAG_RE = re.compile(r'<[^>]*>')
+
+
+def html_to_text(value):
+    """Return the visible text of an HTML fragment.
+    """
+    value = TAG_RE.sub(' ', SCRIPT_RE.sub(' ', value))
+    return re.sub(r'\s+', ' ', html.unescape(value)).strip()
+
+
+def get_block_text(block):
+    """Return the indexable text of a Content body block: heading text,
+    and the visible text of rich text and raw HTML. Other blocks have none.
+    """
+    if block.block_type == 'heading':
+        return block.value or ''
+    elif block.block_type == 'rich_text':
+        return html_to_text(block.value.source)
+    elif block.block_type == 'raw':
+        return html_to_text(block.value)
+    return ''
+
+
+def get_body_text(body, block_types):
+    """Return the text of the blocks of a body with the given types.
+    """
+    if not body:
+        return ''
+    return ' '.join(get_block_text(block) for block in body if block.block_type in block_types)
+
+
+def get_included_text(page):
+    """Return the text of every page that ``page`` includes, directly or
+    through nested include_content blocks.
+    """
+    return ' '.join(
+        get_body_text(included.body, ('heading', 'rich_text', 'raw')) for included in get_included_pages(page))
+
+
+def reindex_includers(page):
+    """Update the search index entries of live pages that include ``page``
+    (directly or transitively), as their indexed text contains its text.
+    """
+    for includer in get_includers(page):
+        index.insert_or_update_object(includer)
+
+
+def get_result_count(query_string, results):
+    """Return the number of results for a query, counted once per query and
+    'pages' generation.
+    """
+    key = make_key(COUNT_KEY, get_generation('pages'), normalise_query_string(query_string))
+    count = cache.get(key)
+    metrics.inc('oim_cms_cache_requests_total', cache='search_count', result='miss' if count is None else 'hit')
+    if count is None:
+        count = results.count()
+        cache.set(key, count, settings.RENDER_CACHE_TIMEOUT)
+    return count
+
+
+def highlight(text, query_string):
+    """Escape ``text`` and wrap each occurrence of a query term in <mark>.
+    """
+    terms = sorted(set(term for term in query_string.split() if len(term) > 1), key=len, reverse=True)
+    if not terms:
+        return escape(text)
+    pattern = re.compile('({})'.format('|'.join(re.escape(term) for term in terms)), re.IGNORECASE)
+    parts = pattern.split(text)
+    # re.split with a capture group alternates unmatched and matched parts.
+    return mark_safe(''.join(
+        format_html('<mark>{}</mark>', part) if i % 2 else escape(part)
+        for i, part in enumerate(parts)))
+
+
+class SearchHit(object):
+
+    def __init__(self, page, snippet):
+        self.page = page
+        self.snippet = snippet
+
+
+class SearchResultsPage(object):
+    """One page of search results.
+
+    Only ``per_page`` results are fetched, and each is shown with a highlighted
+    snippet of its stored excerpt rather than by rendering its body, so the
+    cost of a search is bounded by the page size and not the corpus size.
+    A missing or stale excerpt is rendered for the hit but not stored.
+    """
+    def __init__(self, query_string, results, number=1, per_page=None):
+        self.query_string = query_string
+        self.per_page = per_page or settings.SEARCH_RESULTS_PER_PAGE
+        self.count = get_result_count(query_string, results)
+        self.num_pages = max(1, int(math.ceil(self.count / float(self.per_page))))
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            number = 1
+        self.number = min(max(number, 1), self.num_pages)
+        self.offset = (self.number - 1) * self.per_page
+        self.hits = self.get_hits(results[self.offset:self.offset + self.per_page])
+
+    def get_hits(self, pages):
+        from core.models import ContentExcerpt
+        pages = list(pages)
+        excerpts = {
+            excerpt.page_id: excerpt
+            for excerpt in ContentExcerpt.objects.filter(page__in=[page.pk for page in pages])}
+        hits = []
+        for page in pages:
+            excerpt = excerpts.get(page.pk)
+            if excerpt is None or excerpt.revision_id != page.live_revision_id:
+                excerpt = build_excerpt(page)
+            hits.append(SearchHit(page, highlight(excerpt.text, self.query_string)))
+        return hits
+
+    def __bool__(self):
+        return bool(self.count)
+
+    def __iter__(self):
+        return iter(self.hits)
+
+    @property
+    def start_index(self):
+        return self.offset + 1 if self.count else 0
+
+    @property
+    def end_index(self):
+        return self.offset + len(self.hits)
+
+    @property
+    def has_previous(self):
+        return self.number > 1
+
+    @property
+    def has_next(self):
+        return self.number < self.num_pages
+
+    @property
+    def previous_page_number(self):
+        return self.number - 1
+
+    @property
+    def next_page_number(self):
+        return self.number + 1
@@ -0,0 +1,123 @@
+from collections import Counter
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.utils import timezone
+from wagtail.search.models import Query, QueryDailyHits
+from wagtail.search.utils import normalise_query_string
+import atexit
+import logging
+import os
+import threading
+
+
+LOGGER = logging.getLogger('cms')
+
+
+class HitBuffer(object):
+    """Aggregates search query hits in memory and writes them to the Wagtail
+    search statistics tables in bulk, from a background thread.
+
+    The buffer is flushed every ``interval`` seconds, as soon as ``size``
+    distinct queries are waiting, and when the process exits.
+    """
+    def __init__(self, interval, size):
+        self.interval = interval
+        self.size = size
+        self._hits = Counter()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+
+    def add(self, query_string):
+        query_string = normalise_query_string(query_string)
+        if not query_string:
+            return
+        self._ensure_thread()
+        with self._lock:
+            self._hits[(query_string, timezone.now().date())] += 1
+            if len(self._hits) >= self.size:
+                self._wake.set()
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so each (gunicorn) worker process
+        # starts its own flusher on first use.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._hits.clear()
+            thread = threading.Thread(target=self._run, name='search-hits', daemon=True)
+            thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                LOGGER.exception(e)
+            finally:
+                connection.close()
+
+    def flush(self):
+        """Write all buffered hits to the database. If the write fails, the
+        hits are returned to the buffer for the next flush.
+        """
+        with self._lock:
+            hits, self._hits = self._hits, Counter()
+        if not hits:
+            return
+        try:
+            self.write(hits)
+        except Exception:
+            with self._lock:
+                self._hits.update(hits)
+            raise
+
+    def write(self, hits):
+        query_strings = set(query_string for query_string, date in hits)
+        with transaction.atomic():
+            Query.objects.bulk_create(
+                [Query(query_string=query_string) for query_string in query_strings],
+                ignore_conflicts=True)
+            queries = dict(
+                Query.objects.filter(query_string__in=query_strings).values_list('query_string', 'pk'))
+            QueryDailyHits.objects.bulk_create(
+                [QueryDailyHits(query_id=queries[query_string], date=date, hits=0)
+                 for query_string, date in hits],
+                ignore_conflicts=True)
+            for (query_string, date), count in hits.items():
+                QueryDailyHits.objects.filter(query_id=queries[query_string], date=date).update(
+                    hits=models.F('hits') + count)
+
+
+hit_buffer = HitBuffer(settings.SEARCH_HITS_FLUSH_INTERVAL, settings.SEARCH_HITS_FLUSH_SIZE)
+
+
+def record_hit(query_string):
+    """Record a search for ``query_string`` without writing to the database
+    during the request.
+    """
+    hit_buffer.add(query_string)
+
+
+def flush_hits():
+    """Write buffered search hits now, e.g. before a worker process exits.
+    """
+    try:
+        hit_buffer.flush()
+    except Exception as e:
+        LOGGER.exception(e)
+
+
+def discard_hits():
+    """Drop buffered search hits, e.g. those of synthetic benchmark traffic.
+    """
+    with hit_buffer._lock:
+        hit_buffer._hits.clear()
+
+
+atexit.register(flush_hits)
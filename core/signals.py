@@ -0,0 +1,131 @@
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from wagtail.core.models import Page, PageRevision, PageViewRestriction, Site
+from wagtail.core.signals import page_published, page_unpublished, post_page_move
+from wagtail.documents import get_document_model
+from wagtail.images import get_image_model
+
+from core import export
+from core.cache import bump_generation, forget_generations, memoise_generations
+from core.drafts import index_revision
+from core.excerpts import update_excerpt
+from core.models import Content
+from core.search import reindex_includers
+
+
+@receiver(request_started)
+def start_generation_memo(sender, **kwargs):
+    memoise_generations()
+
+
+@receiver(request_finished)
+def end_generation_memo(sender, **kwargs):
+    forget_generations()
+
+
+@receiver(page_published)
+@receiver(page_unpublished)
+@receiver(post_page_move)
+@receiver(post_delete, sender=Page)
+def invalidate_rendered_pages(sender, instance, **kwargs):
+    """Rendered pages embed menus, included snippets and content lists drawn
+    from other pages, so any publish, unpublish, move or delete invalidates them all.
+    """
+    bump_generation('pages')
+
+
+@receiver(post_save, sender=get_document_model())
+@receiver(post_save, sender=get_image_model())
+@receiver(post_delete, sender=get_document_model())
+@receiver(post_delete, sender=get_image_model())
+def invalidate_media(sender, instance, created=False, update_fields=None, **kwargs):
+    """Rendered pages (and the memoised rich text references of each page)
+    carry document and image URLs, so replacing or deleting one invalidates
+    them. A new document or image can't be referenced yet, and Wagtail's
+    lazily recorded file sizes and hashes don't appear in pages.
+    """
+    if created or (update_fields and set(update_fields) <= {'file_size', 'file_hash'}):
+        return
+    bump_generation('pages')
+
+
+@receiver(post_save, sender=Site)
+@receiver(post_delete, sender=Site)
+def invalidate_sites(sender, instance, **kwargs):
+    """Site hostnames, ports and root pages determine both request routing
+    and the URLs in rendered pages.
+    """
+    bump_generation('sites')
+    bump_generation('pages')
+
+
+@receiver(page_published)
+@receiver(page_unpublished)
+@receiver(post_page_move)
+def invalidate_site_roots(sender, instance, **kwargs):
+    """Cached sites carry their root page, so a change to one invalidates them.
+    """
+    if Site.objects.filter(root_page_id=instance.pk).exists():
+        bump_generation('sites')
+
+
+@receiver(page_published, sender=Content)
+def store_excerpt(sender, instance, **kwargs):
+    update_excerpt(instance)
+
+
+@receiver(page_published, sender=Content)
+def update_includers_search_index(sender, instance, **kwargs):
+    reindex_includers(instance)
+
+
+@receiver(post_save, sender=PageRevision)
+def index_draft_path(sender, instance, created, **kwargs):
+    if created:
+        index_revision(instance)
+
+
+@receiver(page_published, sender=Content)
+@receiver(page_unpublished)
+@receiver(post_page_move)
+def export_static_pages(sender, instance, **kwargs):
+    """Wake the background worker (run_background_tasks) to export the pages
+    that may have changed, once the change is committed and visible to it.
+    """
+    if settings.STATIC_EXPORT_ON_PUBLISH:
+        transaction.on_commit(lambda: bump_generation('export'))
+
+
+@receiver(page_unpublished)
+@receiver(post_delete, sender=Page)
+def remove_static_page(sender, instance, **kwargs):
+    if settings.STATIC_EXPORT_ON_PUBLISH:
+        export.remove_page(instance.url_path)
+
+
+@receiver(post_save, sender=PageViewRestriction)
+def remove_restricted_static_pages(sender, instance, **kwargs):
+    # Restrictions apply to the page's descendants too.
+    if settings.STATIC_EXPORT_ON_PUBLISH:
+        export.remove_page(instance.page.url_path, subtree=True)
+
+
+@receiver(post_page_move)
+def remove_moved_static_pages(sender, instance, url_path_before, **kwargs):
+    if settings.STATIC_EXPORT_ON_PUBLISH:
+        export.remove_page(url_path_before, subtree=True)
+
+
+@receiver(post_save, sender=get_image_model())
+def generate_image_renditions(sender, instance, update_fields=None, **kwargs):
+    """Wake the background worker (see core.images) to generate the rich text
+    renditions of a saved image, so that the first page request showing it
+    doesn't have to. Saves of only some fields, such as Wagtail's file_size
+    and file_hash updates, don't replace the file and are skipped.
+    """
+    if update_fields:
+        return
+    transaction.on_commit(lambda: bump_generation('images'))
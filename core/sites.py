@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.http.request import split_domain_port
+from wagtail.core.models import Site
+from wagtail.core.sites import get_site_for_hostname
+import threading
+
+from core.cache import get_generation
+
+
+_lock = threading.Lock()
+# Sites (with their root pages loaded) are held per process, keyed by the
+# requested hostname and port, and discarded whenever the 'sites' generation
+# changes.
+_sites = {'generation': None, 'hosts': {}}
+
+
+def find_site(request):
+    """Return the Site responsible for a request (as Site.find_for_request
+    does), or None. Steady-state lookups cost one cache read and no queries.
+
+    Changes to sites reach every worker through the 'sites' stamp in the
+    default cache, which must therefore be shared (see core.checks).
+    """
+    hostname = split_domain_port(request.get_host())[0]
+    key = (hostname, request.get_port())
+    generation = get_generation('sites')
+    with _lock:
+        if _sites['generation'] != generation:
+            _sites.update(generation=generation, hosts={})
+        hosts = _sites['hosts']
+        if key in hosts:
+            return hosts[key]
+    try:
+        site = get_site_for_hostname(*key)
+        site.root_page  # Fetch it now rather than on every request.
+    except Site.DoesNotExist:
+        site = None
+    with _lock:
+        if _sites['generation'] == generation:
+            # Unknown hostnames all resolve to the default site, so don't let
+            # arbitrary Host headers grow the cache without bound.
+            if len(hosts) >= settings.SITE_CACHE_SIZE:
+                hosts.clear()
+            hosts[key] = site
+    return site
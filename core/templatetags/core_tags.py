@@ -1,30 +1,33 @@
 from django import template
-from django.shortcuts import render
 import json
 
+from core import excerpts, rendering
+from core.includes import render_include
+from core.navigation import get_ancestors, get_menu_children, mark_active
+from core.page_urls import get_page_url
+
 register = template.Library()
 
 
 @register.filter
 def get_excerpt(page):
-    result = render(
-        None, 'core/tags/include_content.html', context={
-        "self": page,
-        "embed": True}
-    )
-    return result.content
+    return excerpts.get_excerpt(page).html
+
+
+@register.simple_tag
+def render_blocks(body):
+    return rendering.render_blocks(body)
+
+
+@register.simple_tag(takes_context=True)
+def page_url(context, page):
+    # As {% pageurl %}, but from the per-process URL map (see core.page_urls).
+    return get_page_url(page, context.get('request')) or ''
 
 
-@register.inclusion_tag('core/tags/include_content.html', takes_context=True)
+@register.simple_tag(takes_context=True)
 def include_content(context, value):
-    from core.models import Content
-    try:
-        page = Content.objects.get(slug=value)
-    except Exception as e:
-        page = None
-        context.update({"error": "{}: {}".format(value, e)})
-    context.update({"self": page})
-    return context
+    return render_include(context, value)
 
 
 @register.inclusion_tag('core/tags/content_list.html', takes_context=True)
@@ -34,9 +37,9 @@ def content_list(context, value):
         val = json.loads(value)
         tags, limit = val["tags"].split(","), int(val["limit"])
         if not tags[0]:  # if tags is blank string return all items
-            pages = Content.objects.all()[:limit]
+            pages = Content.objects.select_related('excerpt')[:limit]
         else:
-            pages = Content.objects.filter(tags__name__in=tags).distinct()[:limit]
+            pages = Content.objects.filter(tags__name__in=tags).select_related('excerpt').distinct()[:limit]
     except Exception as e:
         pages = None
         context.update({"error": "{}: {}".format(value, e)})
@@ -51,78 +54,40 @@ def get_site_root(context):
     return context['request'].site.root_page
 
 
-def has_menu_children(page):
-    return page.get_children().live().in_menu().exists()
-
-
 @register.simple_tag()
 def page_menuitems(x):
-    menuitems = []
-    while x:
-        menuitems.append(x)
-        x = x.get_parent()
-
-    if menuitems:
-        menuitems.pop()
-    menuitems.reverse()
-    return menuitems
+    return get_ancestors(x)
 
 
 @register.inclusion_tag('core/tags/breadcrumbs.html', takes_context=True)
 def breadcrumbs(context, calling_page):
-    x = calling_page
-    menuitems = []
-    while x:
-        menuitems.append(x)
-        x = x.get_parent()
-
-    if menuitems:
-        menuitems.pop()
-    menuitems.reverse()
     return {
-        'menuitems': menuitems,
+        'menuitems': get_ancestors(calling_page),
         'request': context['request']
     }
 
 
-# Retrieves the top menu items - the immediate children of the parent page
-# The has_menu_children method is necessary because the bootstrap menu requires
-# a dropdown class to be applied to a parent
+# Retrieves the top menu items - the immediate children of the parent page.
+# Items come from the cached per-site menu tree, with show_dropdown (needed
+# because the bootstrap menu applies a dropdown class to a parent) and the URL
+# precomputed; only the active flags are worked out per request.
 @register.inclusion_tag('core/tags/f6_top_menu.html', takes_context=True)
 def f6_top_menu(context, parent, calling_page=None):
-    menuitems = parent.get_children().live().in_menu()
-    for menuitem in menuitems:
-        menuitem.show_dropdown = has_menu_children(menuitem)
-        # We don't directly check if calling_page is None since the template
-        # engine can pass an empty string to calling_page
-        # if the variable passed as calling_page does not exist.
-        menuitem.active = (calling_page.url.startswith(menuitem.url)
-                           if calling_page else False)
+    menuitems = mark_active(get_menu_children(context['request'], parent), calling_page, context['request'])
     return {
         'calling_page': calling_page,
         'menuitems': menuitems,
-        # required by the pageurl tag that we want to use within this template
         'request': context['request'],
     }
 
 
 # Retrieves the top menu items - the immediate children of the parent page
-# The has_menu_children method is necessary because the bootstrap menu requires
-# a dropdown class to be applied to a parent
 @register.inclusion_tag('core/tags/top_menu.html', takes_context=True)
 def top_menu(context, parent, calling_page=None):
-    menuitems = parent.get_children().live().in_menu()
-    for menuitem in menuitems:
-        menuitem.show_dropdown = has_menu_children(menuitem)
-        # We don't directly check if calling_page is None since the template
-        # engine can pass an empty string to calling_page
-        # if the variable passed as calling_page does not exist.
-        menuitem.active = (calling_page.url.startswith(menuitem.url)
-                           if calling_page else False)
+    menuitems = mark_active(get_menu_children(context['request'], parent), calling_page, context['request'])
     return {
         'calling_page': calling_page,
         'menuitems': menuitems,
-        # required by the pageurl tag that we want to use within this template
         'request': context['request'],
     }
 
@@ -130,17 +95,10 @@ def top_menu(context, parent, calling_page=None):
 # Retrieves the children of the top menu items for the drop downs
 @register.inclusion_tag('core/tags/f6_top_menu_children.html', takes_context=True)
 def f6_top_menu_children(context, parent, vertical):
-    menuitems_children = parent.get_children().live().in_menu()
-
-    # This would help to create multilevel nav bars
-    for menuitem in menuitems_children:
-        menuitem.show_dropdown = has_menu_children(menuitem)
-
     return {
         'vertical': vertical,
         'parent': parent,
-        'menuitems_children': menuitems_children,
-        # required by the pageurl tag that we want to use within this template
+        'menuitems_children': get_menu_children(context['request'], parent),
         'request': context['request'],
     }
 
@@ -148,16 +106,9 @@ def f6_top_menu_children(context, parent, vertical):
 # Retrieves the children of the top menu items for the drop downs
 @register.inclusion_tag('core/tags/top_menu_children.html', takes_context=True)
 def top_menu_children(context, parent):
-    menuitems_children = parent.get_children().live().in_menu()
-
-    # This would help to create multilevel nav bars
-    for menuitem in menuitems_children:
-        menuitem.show_dropdown = has_menu_children(menuitem)
-
     return {
         'parent': parent,
-        'menuitems_children': menuitems_children,
-        # required by the pageurl tag that we want to use within this template
+        'menuitems_children': get_menu_children(context['request'], parent),
         'request': context['request'],
     }
 
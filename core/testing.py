@@ -0,0 +1,242 @@
+"""
+Support for guarding the number of database queries issued while rendering.
+
+``build_page_tree`` creates a representative tree of Content pages, and
+``QueryBudget`` captures the queries run inside a block, checking them
+against a maximum count and flagging repeated identical query shapes (the
+signature of an N+1 pattern), along with the template tag that issued them.
+Queries issued by a DatabaseCache are counted against a budget of their
+own, as their number depends on the configured cache backend.
+"""
+from collections import Counter
+from django.conf import settings
+from django.db import connection
+import json
+import re
+import sys
+
+
+# Default budgets per rendered view, keyed like the request metrics labels
+# (see Content.serve and oim_cms.middleware.MetricsMiddleware). These are
+# measured with cold caches, as the worst case for an anonymous request.
+# Wagtail's routing runs one query per URL segment, so page budgets allow
+# that shape to repeat once per level of a deep tree. Cold renders store each
+# fragment they render, which costs several queries apiece with a
+# DatabaseCache (and none with memcached).
+QUERY_BUDGETS = {
+    'page:f6-content.html': {'max_queries': 25, 'max_repeats': 8, 'max_cache_queries': 60},
+    'page:content.html': {'max_queries': 25, 'max_repeats': 8, 'max_cache_queries': 60},
+    'page:f6-content-minimal.html': {'max_queries': 25, 'max_repeats': 8, 'max_cache_queries': 60},
+    'page:f6-vue.html': {'max_queries': 25, 'max_repeats': 8, 'max_cache_queries': 60},
+    # A page served from the render cache (see core.cache), which costs only
+    # Wagtail's routing and two cache reads: the stamps and the page.
+    'page:cached': {'max_queries': 10, 'max_repeats': 8, 'max_cache_queries': 2},
+    'search': {'max_queries': 15, 'max_repeats': 3, 'max_cache_queries': 30},
+    '404': {'max_queries': 15, 'max_repeats': 8, 'max_cache_queries': 50},
+}
+DEFAULT_BUDGET = {'max_queries': 50, 'max_repeats': 10, 'max_cache_queries': None}
+DATABASE_CACHE_MODULE = 'django.core.cache.backends.db'
+
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_shape(sql):
+    """Return the shape of a parameterised SQL statement, with IN lists of
+    any length collapsed so that batched lookups share a shape.
+    """
+    return IN_LIST_RE.sub('IN (...)', sql)
+
+
+def is_cache_query():
+    """Return whether the query being run by the current thread was issued
+    by a DatabaseCache (including the savepoints around its writes).
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_globals.get('__name__') == DATABASE_CACHE_MODULE:
+            return True
+        frame = frame.f_back
+    return False
+
+
+def find_template_node():
+    """Return a description of the innermost template node being rendered
+    by the current thread, or None.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            token = getattr(node, 'token', None)
+            origin = getattr(node, 'origin', None)
+            if token is not None:
+                return '{} {{% {} %}}'.format(getattr(origin, 'template_name', '?'), token.contents)
+        frame = frame.f_back
+    return None
+
+
+class QueryBudget(object):
+    """Capture the queries run inside a ``with`` block.
+
+    Example::
+
+        with QueryBudget(max_queries=20, max_repeats=3) as budget:
+            client.get('/some/page/')
+        budget.check()
+    """
+    def __init__(self, max_queries=None, max_repeats=None, label='', locate=True, max_cache_queries=None):
+        self.max_queries = max_queries
+        self.max_repeats = max_repeats
+        self.max_cache_queries = max_cache_queries
+        self.label = label
+        self.locate = locate
+        # (shape, template node) of every query, and the shapes of those
+        # issued by the cache.
+        self.queries = []
+        self.cache_queries = []
+        self.database_cache = settings.CACHES['default']['BACKEND'].startswith(DATABASE_CACHE_MODULE + '.')
+
+    @classmethod
+    def for_label(cls, label, **kwargs):
+        """Return a budget with the limits configured for a view label.
+        """
+        budget = cls(**kwargs)
+        budget.set_label(label)
+        return budget
+
+    def set_label(self, label):
+        """Apply the limits configured in QUERY_BUDGETS for a view label.
+        """
+        limits = QUERY_BUDGETS.get(label, DEFAULT_BUDGET)
+        self.label = label
+        self.max_queries = limits['max_queries']
+        self.max_repeats = limits['max_repeats']
+        self.max_cache_queries = limits['max_cache_queries']
+
+    def __call__(self, execute, sql, params, many, context):
+        shape = query_shape(sql)
+        if self.database_cache and is_cache_query():
+            self.cache_queries.append(shape)
+        else:
+            self.queries.append((shape, find_template_node() if self.locate else None))
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+    def repeated_shapes(self):
+        """Return (shape, count, template nodes) for each query shape repeated
+        more than ``max_repeats`` times.
+        """
+        if self.max_repeats is None:
+            return []
+        counts = Counter(shape for shape, node in self.queries)
+        repeated = []
+        for shape, count in counts.most_common():
+            if count <= self.max_repeats:
+                break
+            nodes = sorted(set(node for s, node in self.queries if s == shape and node))
+            repeated.append((shape, count, nodes))
+        return repeated
+
+    def violations(self):
+        messages = []
+        if self.max_queries is not None and len(self.queries) > self.max_queries:
+            messages.append('{}: {} queries exceeds the budget of {}'.format(
+                self.label, len(self.queries), self.max_queries))
+        if self.max_cache_queries is not None and len(self.cache_queries) > self.max_cache_queries:
+            messages.append('{}: {} cache queries exceeds the budget of {}'.format(
+                self.label, len(self.cache_queries), self.max_cache_queries))
+        for shape, count, nodes in self.repeated_shapes():
+            messages.append('{}: query repeated {} times (N+1?) from {}: {}'.format(
+                self.label, count, ', '.join(nodes) or 'outside templates', shape))
+        return messages
+
+    def check(self):
+        """Raise QueryBudgetExceeded if the budget was exceeded.
+        """
+        messages = self.violations()
+        if messages:
+            raise QueryBudgetExceeded('\n'.join(messages))
+
+
+def make_body(*blocks):
+    """Return StreamField JSON for Content.body from (block_type, value) pairs.
+    """
+    return json.dumps([{'type': block_type, 'value': value} for block_type, value in blocks])
+
+
+def build_snippets(parent, prefix='page', include_depth=1, publish=True):
+    """Create (or find) a chain of ``include_depth`` snippet pages below
+    ``parent``, each including the next, and return the first.
+    """
+    from core.models import Content
+    snippet = None
+    for level in reversed(range(include_depth)):
+        slug = '{}-snippet{}'.format(prefix, '-{}'.format(level) if level else '')
+        existing = Content.objects.filter(slug=slug).first()
+        if existing is not None:
+            snippet = existing
+            continue
+        blocks = [('rich_text', '<p>Shared snippet text.</p>')]
+        if snippet is not None:
+            blocks.append(('include_content', snippet.slug))
+        snippet = Content(title='Snippet', slug=slug, show_in_menus=False, body=make_body(*blocks))
+        parent.add_child(instance=snippet)
+        if publish:
+            snippet.save_revision().publish()
+    return snippet
+
+
+def build_page_tree(parent, depth=3, breadth=3, tags=('news',), prefix='page', publish=True,
+                    include_depth=1, limit=None):
+    """Create a tree of Content pages below ``parent`` and return them in
+    creation order.
+
+    Each page has a heading and rich text that links to its parent, is shown
+    in menus and tagged with ``tags``. The first child of each page includes
+    a shared snippet (itself nested ``include_depth`` deep) and lists tagged
+    pages, so that menus, breadcrumbs, include_content and content_list are
+    all exercised. At most ``limit`` pages are created, if given.
+    """
+    from core.models import Content
+    snippet = build_snippets(parent, prefix, include_depth, publish)
+    pages = []
+
+    def add_children(page, level, path):
+        if level > depth:
+            return
+        for i in range(breadth):
+            if limit is not None and len(pages) >= limit:
+                return
+            slug = '{}-{}{}'.format(prefix, path, i)
+            blocks = [
+                ('heading', 'Heading {}'.format(slug)),
+                ('rich_text', '<p>Body of {} with a <a linktype="page" id="{}">link</a>.</p>'.format(slug, page.pk)),
+            ]
+            if i == 0:
+                blocks += [
+                    ('include_content', snippet.slug),
+                    ('content_list', json.dumps({'tags': ','.join(tags), 'limit': 5})),
+                ]
+            child = Content(title=slug.replace('-', ' ').title(), slug=slug, show_in_menus=True, body=make_body(*blocks))
+            page.add_child(instance=child)
+            child.tags.add(*tags)
+            if publish:
+                child.save_revision().publish()
+            else:
+                child.save()
+            pages.append(child)
+            add_children(child, level + 1, '{}{}-'.format(path, i))
+
+    add_children(parent, 1, '')
+    return pages
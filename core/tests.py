@@ -0,0 +1,411 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core import mail
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.images import ImageFile
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.template import Context, Template
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from io import BytesIO, StringIO
+from PIL import Image as PILImage
+from wagtail.core.models import Site
+from wagtail.images import get_image_model
+import json
+import os
+import shutil
+import smtplib
+import tempfile
+
+from core.cache import bump_generation, get_generation
+from core.checks import check_shared_cache
+from core.excerpts import get_excerpt
+from core.export import get_export_paths
+from core.images import get_filter_specs
+from core.mail import enqueue_mail, send_batch
+from core.models import Content, ContentExcerpt, OutboundMessage
+from core.navigation import get_ancestors
+from core.page_urls import get_page_url
+from core.search_hits import discard_hits
+from core.testing import QueryBudget, build_page_tree
+from oim_cms import metrics
+from oim_cms.utils import FieldsFormatter, iter_csv, iter_jsonl
+
+
+# The queries (with the default DatabaseCache) of two cache reads
+# and a write, and of two reads.
+COLD_CACHE_QUERIES = 7
+WARM_CACHE_QUERIES = 2
+# Templates are rendered without collecting static files first.
+TEST_STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+
+
+def count_render_cache(result):
+    """Return this process's count of render cache hits or misses.
+    """
+    for name, labels, value in metrics.snapshot()['counters']:
+        if name == 'oim_cms_cache_requests_total' and labels == {'cache': 'render', 'result': result}:
+            return value
+    return 0
+
+
+class SharedCacheTest(TestCase):
+
+    def test_per_process_backends(self):
+        for backend in settings.PER_PROCESS_CACHE_BACKENDS:
+            with self.subTest(backend=backend), override_settings(CACHES={'default': {'BACKEND': backend}}):
+                self.assertEqual([error.id for error in check_shared_cache(None)], ['core.E001'])
+        self.assertEqual(check_shared_cache(None), [])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_dummy_cache_generation(self):
+        # Nothing keyed on a stamp is reused, as nothing is stored to reuse.
+        first = get_generation('sites')
+        self.assertIsNotNone(first)
+        self.assertNotEqual(get_generation('sites'), first)
+
+
+class BreadcrumbsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.site = Site.objects.get(is_default_site=True)
+        # A chain of pages, one per level, for each depth.
+        cls.leaves = {
+            depth: build_page_tree(cls.site.root_page, depth=depth, breadth=1, prefix='depth{}'.format(depth))[-1]
+            for depth in (3, 6)
+        }
+
+    def setUp(self):
+        cache.clear()
+        bump_generation('pages')
+        self.request = RequestFactory().get('/', HTTP_HOST=self.site.hostname)
+        self.request.user = AnonymousUser()
+        self.request.site = self.site
+        # Prime the page URL map, which isn't part of the breadcrumb lookup.
+        get_page_url(self.site.root_page, self.request)
+
+    def test_ancestors(self):
+        for depth, leaf in self.leaves.items():
+            with self.subTest(depth=depth):
+                # One query, whatever the depth, plus reading the stamps and
+                # the ancestors from the cache and storing them.
+                with QueryBudget(max_queries=1, max_cache_queries=COLD_CACHE_QUERIES) as budget:
+                    ancestors = get_ancestors(leaf)
+                budget.check()
+                self.assertEqual(len(ancestors), depth + 1)
+                self.assertEqual(ancestors[0], self.site.root_page)
+                self.assertEqual(ancestors[-1], leaf)
+                # Cached until a page is published.
+                with QueryBudget(max_queries=0, max_cache_queries=WARM_CACHE_QUERIES) as budget:
+                    self.assertEqual(get_ancestors(leaf), ancestors)
+                budget.check()
+
+    def test_breadcrumbs(self):
+        template = Template('{% load core_tags %}{% breadcrumbs page %}')
+        for depth, leaf in self.leaves.items():
+            with self.subTest(depth=depth):
+                with QueryBudget(max_queries=1, max_cache_queries=COLD_CACHE_QUERIES) as budget:
+                    html = template.render(Context({'request': self.request, 'page': leaf}))
+                budget.check()
+                self.assertEqual(html.count('<li'), depth + 3)
+                self.assertIn('class="current"', html)
+
+
+class ExcerptTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        site = Site.objects.get(is_default_site=True)
+        cls.page = build_page_tree(site.root_page, depth=1, breadth=1, prefix='excerpt')[-1]
+
+    def test_stored_on_publish(self):
+        page = Content.objects.select_related('excerpt').get(pk=self.page.pk)
+        self.assertEqual(page.excerpt.revision_id, page.live_revision_id)
+
+    def test_missing_excerpt_is_not_stored(self):
+        ContentExcerpt.objects.filter(page=self.page).delete()
+        page = Content.objects.select_related('excerpt').get(pk=self.page.pk)
+        excerpt = get_excerpt(page)
+        self.assertIsNone(excerpt.pk)
+        self.assertTrue(excerpt.text)
+        self.assertFalse(ContentExcerpt.objects.filter(page=self.page).exists())
+
+
+@override_settings(STATICFILES_STORAGE=TEST_STATICFILES_STORAGE, ALLOWED_HOSTS=['*'])
+class QueryBudgetTest(TestCase):
+    """Renders each view within its budget in QUERY_BUDGETS, with cold caches
+    and from the render cache, counting the queries of the configured cache
+    backend.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.site = Site.objects.get(is_default_site=True)
+        pages = build_page_tree(cls.site.root_page, depth=3, breadth=3, prefix='budget')
+        # The deepest first child, which includes a snippet and lists pages.
+        cls.page = [page for page in pages if page.slug.endswith('-0')][-1]
+
+    def setUp(self):
+        cache.clear()
+        bump_generation('pages')
+        self.client = Client(HTTP_HOST=self.site.hostname)
+
+    def tearDown(self):
+        discard_hits()
+
+    def test_pages(self):
+        url = self.page.relative_url(self.site)
+        for template_name, label in Content._meta.get_field('template_filename').choices:
+            with self.subTest(template=template_name):
+                bump_generation('pages')
+                with QueryBudget.for_label('page:{}'.format(template_name)) as budget:
+                    response = self.client.get(url, {'template': template_name})
+                self.assertEqual(response.status_code, 200)
+                budget.check()
+
+    def test_cached_pages(self):
+        url = self.page.relative_url(self.site)
+        for template_name, label in Content._meta.get_field('template_filename').choices:
+            with self.subTest(template=template_name):
+                bump_generation('pages')
+                self.client.get(url, {'template': template_name})
+                hits = count_render_cache('hit')
+                with QueryBudget.for_label('page:cached') as budget:
+                    response = self.client.get(url, {'template': template_name})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(count_render_cache('hit'), hits + 1)
+                budget.check()
+
+    def test_uncacheable_pages(self):
+        url = self.page.relative_url(self.site)
+        user = get_user_model().objects.create_user('budget', 'budget@example.com', 'password')
+        authenticated = Client(HTTP_HOST=self.site.hostname)
+        authenticated.force_login(user)
+        requests = (
+            ('authenticated', authenticated, {'template': 'content.html'}),
+            ('query', self.client, {'template': 'content.html', 'utm_source': 'budget'}),
+        )
+        for name, client, params in requests:
+            with self.subTest(request=name):
+                bump_generation('pages')
+                client.get(url, params)
+                lookups = count_render_cache('hit') + count_render_cache('miss')
+                with QueryBudget.for_label('page:content.html') as budget:
+                    response = client.get(url, params)
+                self.assertEqual(response.status_code, 200)
+                # Rendered again, without reading the render cache.
+                self.assertEqual(count_render_cache('hit') + count_render_cache('miss'), lookups)
+                budget.check()
+
+    def test_search(self):
+        with QueryBudget.for_label('search') as budget:
+            response = self.client.get('/search', {'q': 'body'})
+        self.assertEqual(response.status_code, 200)
+        budget.check()
+
+    def test_not_found(self):
+        with QueryBudget.for_label('404') as budget:
+            response = self.client.get('/budget-missing-page/')
+        self.assertEqual(response.status_code, 404)
+        budget.check()
+
+
+class RenditionTest(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = self.settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def save_image(self):
+        data = BytesIO()
+        PILImage.new('RGB', (1200, 800), 'green').save(data, 'PNG')
+        with self.captureOnCommitCallbacks(execute=True):
+            return get_image_model().objects.create(
+                title='Green', file=ImageFile(data, name='green.png'))
+
+    def test_generated_by_worker(self):
+        generation = get_generation('images')
+        image = self.save_image()
+        self.assertNotEqual(get_generation('images'), generation)
+        self.assertFalse(image.renditions.exists())
+        call_command('run_background_tasks', stdout=StringIO())
+        self.assertEqual(
+            sorted(image.renditions.values_list('filter_spec', flat=True)), get_filter_specs())
+
+    def test_update_fields_save_skipped(self):
+        image = self.save_image()
+        generation = get_generation('images')
+        with self.captureOnCommitCallbacks(execute=True):
+            image.save(update_fields=['file_size', 'file_hash'])
+        self.assertEqual(get_generation('images'), generation)
+
+
+@override_settings(STATICFILES_STORAGE=TEST_STATICFILES_STORAGE, ALLOWED_HOSTS=['*'], STATIC_EXPORT_ON_PUBLISH=True)
+class StaticExportTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.site = Site.objects.get(is_default_site=True)
+        cls.page = build_page_tree(cls.site.root_page, depth=1, breadth=1, prefix='export')[-1]
+
+    def setUp(self):
+        self.export_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.export_root)
+        export = self.settings(STATIC_EXPORT_ROOT=self.export_root)
+        export.enable()
+        self.addCleanup(export.disable)
+
+    def test_paths_include_port(self):
+        [(site, path, filename)] = get_export_paths(self.page.url_path, [self.site])
+        self.assertEqual(path, '/export-0/')
+        self.assertEqual(filename, os.path.join(
+            self.export_root, '{}_{}'.format(self.site.hostname, self.site.port), 'export-0', 'index.html'))
+
+    def test_exported_by_worker_on_publish(self):
+        generation = get_generation('export')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.page.save_revision().publish()
+        self.assertNotEqual(get_generation('export'), generation)
+        call_command('run_background_tasks', stdout=StringIO())
+        [(site, path, filename)] = get_export_paths(self.page.url_path, [self.site])
+        self.assertTrue(os.path.exists(filename))
+
+
+class RefusingBackend(EmailBackend):
+
+    def send_messages(self, messages):
+        raise smtplib.SMTPRecipientsRefused({'nobody@example.com': (550, b'No such user')})
+
+
+class UnreachableBackend(EmailBackend):
+
+    def open(self):
+        raise ConnectionRefusedError(111, 'Connection refused')
+
+
+class DisconnectingBackend(EmailBackend):
+
+    def send_messages(self, messages):
+        raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+
+
+@override_settings(MAIL_QUEUE_MAX_ATTEMPTS=2)
+class MailQueueTest(TestCase):
+    """Sends queued mail with the locmem email backend (the test default),
+    or with stand-ins for a server that fails.
+    """
+    def setUp(self):
+        self.messages = [
+            enqueue_mail('Subject {}'.format(i), 'Body', 'from@example.com', ['to@example.com'])
+            for i in range(2)]
+
+    def make_due(self):
+        OutboundMessage.objects.update(next_attempt_at=timezone.now())
+
+    def assertQueued(self, attempts):
+        for message in OutboundMessage.objects.all():
+            self.assertEqual(message.status, OutboundMessage.QUEUED)
+            self.assertEqual(message.attempts, attempts)
+            self.assertGreater(message.next_attempt_at, timezone.now())
+            self.assertTrue(message.last_error)
+
+    def test_delivery(self):
+        self.assertEqual(send_batch(), (2, 0))
+        self.assertEqual(sorted(email.subject for email in mail.outbox), ['Subject 0', 'Subject 1'])
+        self.assertEqual(OutboundMessage.objects.filter(status=OutboundMessage.SENT).count(), 2)
+        self.assertEqual(send_batch(), (0, 0))
+
+    def test_retry(self):
+        self.assertEqual(send_batch(connection=RefusingBackend()), (0, 2))
+        self.assertQueued(attempts=1)
+        # Not due again until after the retry delay.
+        self.assertEqual(send_batch(), (0, 0))
+        self.make_due()
+        self.assertEqual(send_batch(), (2, 0))
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_dead_letter(self):
+        for i in range(2):
+            self.make_due()
+            self.assertEqual(send_batch(connection=RefusingBackend()), (0, 2))
+        self.assertEqual(OutboundMessage.objects.filter(status=OutboundMessage.DEAD).count(), 2)
+        self.make_due()
+        self.assertEqual(send_batch(), (0, 0))
+        self.assertEqual(mail.outbox, [])
+
+    def test_connection_failures_not_counted(self):
+        for backend in (UnreachableBackend, DisconnectingBackend) * 2:
+            with self.subTest(backend=backend.__name__):
+                self.make_due()
+                self.assertEqual(send_batch(connection=backend()), (0, 2))
+                self.assertQueued(attempts=0)
+        self.make_due()
+        self.assertEqual(send_batch(), (2, 0))
+
+
+def upper(request, value):
+    return value.upper()
+
+
+class FieldsFormatterTest(SimpleTestCase):
+
+    def test_lookups(self):
+        formatter = FieldsFormatter({'type': upper, 'greeting.en': upper, 'greeting.fr': None})
+        data = formatter.format(None, {'type': 'message', 'greeting': {'en': 'hello', 'fr': 'bonjour'}})
+        self.assertEqual(data, {'type': 'MESSAGE', 'greeting': {'en': 'HELLO', 'fr': 'bonjour'}})
+
+    def test_trailing_dot(self):
+        # "a." formats the value of "a", not the whole object.
+        data = FieldsFormatter({'greeting.': upper}).format(None, [{'greeting': 'hello'}, {'greeting': 'hi'}])
+        self.assertEqual(data, [{'greeting': 'HELLO'}, {'greeting': 'HI'}])
+
+    def test_empty_lookup(self):
+        self.assertEqual(FieldsFormatter({'': upper}).format_object(None, 'hello'), 'HELLO')
+
+    def test_missing_value(self):
+        data = FieldsFormatter({'greeting.en': upper}).format(None, [{'greeting': {}}, {'greeting': {'en': 'hi'}}])
+        self.assertEqual(data, [{'greeting': {}}, {'greeting': {'en': 'HI'}}])
+
+
+class StreamedExportTest(TestCase):
+
+    def setUp(self):
+        for i in range(3):
+            enqueue_mail('Subject {}'.format(i), 'Body', 'from@example.com', ['to@example.com'])
+
+    def test_csv(self):
+        queryset = OutboundMessage.objects.order_by('pk').values('subject', 'status', 'id')
+        lines = ''.join(iter_csv(queryset, field_order=['id'], chunk_size=2)).splitlines()
+        self.assertEqual(lines[0], '\ufeffID,subject,status')
+        self.assertEqual(lines[1:], ['{},Subject {},queued'.format(pk, i) for i, pk in enumerate(
+            queryset.values_list('pk', flat=True))])
+
+    def test_jsonl(self):
+        queryset = OutboundMessage.objects.order_by('pk').values('subject', 'id')
+        lines = ''.join(iter_jsonl(queryset, field_order=['id'], chunk_size=2)).splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(list(json.loads(lines[0])), ['id', 'subject'])
+
+
+@override_settings(METRICS_TOKEN='metrics-token')
+class MetricsTest(TestCase):
+
+    def test_internal_scraper(self):
+        response = Client(REMOTE_ADDR='10.0.0.5').get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('text/plain', response['Content-Type'])
+
+    def test_public_request(self):
+        for client in (Client(REMOTE_ADDR='1.1.1.1'), Client(HTTP_X_FORWARDED_FOR='1.1.1.1')):
+            self.assertEqual(client.get('/metrics').status_code, 404)
+
+    def test_token(self):
+        client = Client(REMOTE_ADDR='1.1.1.1', HTTP_X_FORWARDED_FOR='1.1.1.1')
+        self.assertEqual(client.get('/metrics', HTTP_AUTHORIZATION='Bearer metrics-token').status_code, 200)
+        self.assertEqual(client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 404)
@@ -0,0 +1,16 @@
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+
+def run_in_thread(func, *args, **kwargs):
+    """Run blocking (e.g. database) work from async code on a pooled thread,
+    rather than on the single thread that Django shares between the sync
+    code of all requests under ASGI. The thread's database connections are
+    closed afterwards, as they would be at the end of a request.
+    """
+    def run():
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)()
@@ -1,12 +1,16 @@
-from django.core.mail import send_mail
 from django.http import HttpResponseRedirect, HttpResponse
 from django.shortcuts import render
 from django.utils.safestring import mark_safe
 from django.views.generic import TemplateView
 from wagtail.core import hooks
-from wagtail.core.models import PageRevision
-from wagtail.search.models import Query
-from core.models import Content
+from core import not_found
+from core.conditional import get_not_modified, get_search_validators, make_etag, set_validators
+from core.mail import enqueue_mail
+from core.models import Content, DraftPath
+from core.page_urls import get_page_url
+from core.search import SearchResultsPage
+from core.search_hits import record_hit
+from core.threads import run_in_thread
 
 
 def draft(request, path):
@@ -16,17 +20,16 @@ def draft(request, path):
         path = "/" + path + "/"
     else:
         path = "/"
-    revisions = PageRevision.objects.filter(
-        content_json__icontains='"url_path": "/home{}"'.format(path)).order_by("-created_at")
-    if revisions.exists() and revisions[
-            0].page.get_latest_revision().pk == revisions[0].pk:
+    try:
+        draft_path = DraftPath.objects.select_related('page').get(url_path='/home{}'.format(path).lower())
+    except DraftPath.DoesNotExist:
+        return HttpResponse("No draft exists for url: {}".format(path))
+    if draft_path.page.latest_revision_created_at == draft_path.created_at:
         return HttpResponseRedirect("/admin/pages/{}/view_draft/{}".format(
-            revisions[0].page.pk, request.META.get("QUERY_STRING")))
-    elif revisions.exists():
-        return HttpResponse(
-            "No current draft ({} old) exists for url: {}".format(revisions.count(), path))
+            draft_path.page_id, request.META.get("QUERY_STRING")))
     else:
-        return HttpResponse("No draft exists for url: {}".format(path))
+        return HttpResponse(
+            "No current draft ({} old) exists for url: {}".format(draft_path.revision_count, path))
 
 
 def redirect(request):
@@ -34,34 +37,60 @@ def redirect(request):
     return HttpResponseRedirect("https://{}".format(path))
 
 
+async def async_redirect(request):
+    # Needs no database or template work, so it runs on the event loop.
+    return redirect(request)
+
+
 def search_content(search_query):
     # Search
     search_results = Content.objects.live().exclude(
         url_path__startswith="/home/snippets/").search(search_query)
-    query = Query.get(search_query)
-    # Record hit
-    query.add_hit()
+    # Record hit (buffered and written in bulk outside the request)
+    record_hit(search_query)
     return search_results
 
 
 def search(request):
     search_query = request.GET.get('q', None)
+    validators = get_search_validators(request, search_query)
+    not_modified = get_not_modified(request, *validators)
+    if not_modified is not None:
+        return not_modified
     if search_query:
-        search_results = search_content(search_query)
+        search_results = SearchResultsPage(
+            search_query, search_content(search_query), request.GET.get('page'))
     else:
-        search_results = Content.objects.none()
+        search_results = None
 
-    return render(request, 'core/search_results.html', {
+    return set_validators(render(request, 'core/search_results.html', {
         'search_results': search_results,
-    })
+    }), *validators)
+
+
+async def async_search(request):
+    # Under ASGI, the full-text search runs on a pooled thread, so that slow
+    # searches neither hold the event loop nor queue behind other requests.
+    return await run_in_thread(search, request)
 
 
 def error404(request, exception=None):
+    # Try the cheap slug index first, and only fall back to a full-text
+    # search for paths not already known to be missing, and for clients
+    # within their search budget (crawlers and scanners soon exhaust it).
+    url = not_found.find_redirect(request)
+    if url and url != request.path:
+        return HttpResponseRedirect(url)
+    if not_found.is_known_missing(request.path) or not not_found.allow_search(request):
+        return render(request, '404.html', status=404)
+
     search_query = " ".join(request.get_full_path().split("/"))
-    search_results = search_content(search_query)
-    if search_results.count() == 1:
-        return HttpResponseRedirect(search_results[0].url)
+    search_results = SearchResultsPage(search_query, search_content(search_query))
+    if search_results.count == 1:
+        return HttpResponseRedirect(get_page_url(search_results.hits[0].page, request))
     else:
+        if not search_results:
+            not_found.remember_missing(request.path)
         response = HttpResponse(
             content=render(request, 'core/search_results.html', {
                 'search_results': search_results,
@@ -98,9 +127,9 @@ def submit_form(page, request, serve_args, serve_kwargs):
             {'subject': subject, 'email': True, 'postdata': postdata, 'instructions': instructions}
         )
         email = response.content.decode('utf-8')
-        send_mail(
+        enqueue_mail(
             '{} ( {} )'.format(subject, request.path), email, 'OIM Service Desk <oim.servicedesk@dbca.wa.gov.au>',
-            [request.user.email], html_message=email, fail_silently=False)
+            [request.user.email], html_message=email)
         return response
 
 
@@ -114,3 +143,8 @@ class HealthCheckView(TemplateView):
         context['page_title'] = 'OIM CMS application status'
         context['status'] = 'HEALTHY'
         return context
+
+    def get(self, request, *args, **kwargs):
+        response = super(HealthCheckView, self).get(request, *args, **kwargs).render()
+        etag = make_etag('healthcheck', response.content)
+        return get_not_modified(request, etag) or set_validators(response, etag)
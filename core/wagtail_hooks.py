@@ -0,0 +1,12 @@
+from wagtail.core import hooks
+
+from core.richtext import BatchedDocumentLinkHandler, BatchedImageEmbedHandler, BatchedPageLinkHandler
+
+
+@hooks.register('register_rich_text_features', order=1)
+def register_batched_handlers(features):
+    # Replace the handlers registered by wagtail.core, wagtail.documents and
+    # wagtail.images (at the default order).
+    features.register_link_type(BatchedPageLinkHandler)
+    features.register_link_type(BatchedDocumentLinkHandler)
+    features.register_embed_type(BatchedImageEmbedHandler)
@@ -1,12 +1,45 @@
 # Gunicorn configuration settings.
 import multiprocessing
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "oim_cms.settings")
 
 bind = ":8080"
 # Don't start too many workers:
 workers = min(multiprocessing.cpu_count() * 2 + 1, 16)
+# To serve the ASGI application (oim_cms.asgi) instead, set this to
+# "uvicorn.workers.UvicornWorker" (which needs the uvicorn package).
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "sync")
 # Give workers an expiry:
 max_requests = 2048
 max_requests_jitter = 256
 preload_app = True
 # Disable access logging.
 accesslog = None
+
+
+def on_starting(server):
+    # Discard metrics left over from a previous run of the server.
+    from oim_cms import metrics
+    metrics.reset()
+
+
+def when_ready(server):
+    # Warm up the preloaded application before any workers are forked.
+    from oim_cms.warmup import warm_up
+    for stage, seconds in warm_up():
+        server.log.info("Warm-up %s: %.3fs", stage, seconds)
+
+
+def worker_exit(server, worker):
+    # Write any search hits and metrics buffered by this worker before it is recycled.
+    from core.search_hits import flush_hits
+    from oim_cms import metrics
+    flush_hits()
+    metrics.write_snapshot(force=True)
+
+
+def child_exit(server, worker):
+    # Fold the exited worker's metrics into the archive (runs in the master).
+    from oim_cms import metrics
+    metrics.archive_worker(worker.pid)
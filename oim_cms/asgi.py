@@ -0,0 +1,19 @@
+"""
+ASGI config for oim_cms project.
+It exposes the ASGI callable as a module-level variable named ``application``.
+"""
+import dotenv
+from django.core.asgi import get_asgi_application
+import os
+from pathlib import Path
+
+# These lines are required for interoperability between local and container environments.
+d = Path(__file__).resolve().parents[1]
+dot_env = os.path.join(str(d), '.env')
+if os.path.exists(dot_env):
+    dotenv.read_dotenv(dot_env)
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "oim_cms.settings")
+# Selects the async views that only pay off under ASGI (see settings.ASGI).
+os.environ["ASGI"] = "True"
+application = get_asgi_application()
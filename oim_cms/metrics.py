@@ -0,0 +1,194 @@
+"""
+A minimal Prometheus-style metrics registry.
+
+Each worker process accumulates counters and histograms in memory and
+periodically writes a snapshot to its own file in METRICS_DIR. The /metrics
+endpoint sums the snapshots of every worker (plus an archive of workers that
+have exited), so totals are correct under a preforking server like gunicorn.
+"""
+from django.conf import settings
+import glob
+import json
+import os
+import threading
+import time
+
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+HELP = {
+    'oim_cms_request_duration_seconds': ('histogram', 'Request latency by view or page template.'),
+    'oim_cms_responses_total': ('counter', 'Responses by view or page template and status code.'),
+    'oim_cms_db_queries_total': ('counter', 'Database queries by view or page template.'),
+    'oim_cms_db_query_seconds_total': ('counter', 'Time spent in database queries by view or page template.'),
+    'oim_cms_cache_requests_total': ('counter', 'Application cache lookups by cache and result.'),
+}
+ARCHIVE_FILE = 'archive.json'
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_last_write = [0.0]
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def inc(name, value=1, **labels):
+    """Increment a counter.
+    """
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """Record a value in a histogram. Bucket counts are stored
+    non-cumulatively, followed by the sum and count.
+    """
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(DURATION_BUCKETS) + 3)
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                histogram[i] += 1
+                break
+        else:
+            histogram[len(DURATION_BUCKETS)] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+def snapshot():
+    with _lock:
+        return {
+            'counters': [[name, dict(labels), value] for (name, labels), value in _counters.items()],
+            'histograms': [[name, dict(labels), list(values)] for (name, labels), values in _histograms.items()],
+        }
+
+
+def _worker_file(pid=None):
+    return os.path.join(settings.METRICS_DIR, 'worker-{}.json'.format(pid or os.getpid()))
+
+
+def _write(path, data):
+    tmp = '{}.tmp'.format(path)
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_snapshot(force=False):
+    """Write this process's metrics for other workers to aggregate, at most
+    once per METRICS_WRITE_INTERVAL unless forced.
+    """
+    now = time.monotonic()
+    if not force and now - _last_write[0] < settings.METRICS_WRITE_INTERVAL:
+        return
+    _last_write[0] = now
+    try:
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        _write(_worker_file(), snapshot())
+    except OSError:
+        pass
+
+
+def merge(*snapshots):
+    """Sum any number of snapshots into one.
+    """
+    counters, histograms = {}, {}
+    for data in snapshots:
+        for name, labels, value in data.get('counters', []):
+            key = _key(name, labels)
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in data.get('histograms', []):
+            key = _key(name, labels)
+            if key in histograms:
+                histograms[key] = [a + b for a, b in zip(histograms[key], values)]
+            else:
+                histograms[key] = list(values)
+    return {
+        'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, dict(labels), values] for (name, labels), values in histograms.items()],
+    }
+
+
+def archive_worker(pid):
+    """Fold the snapshot of an exited worker into the archive, so that its
+    counts are kept without one file per recycled worker.
+    """
+    path = _worker_file(pid)
+    if not os.path.exists(path):
+        return
+    archive = os.path.join(settings.METRICS_DIR, ARCHIVE_FILE)
+    _write(archive, merge(_read(archive), _read(path)))
+    os.remove(path)
+
+
+def clear():
+    """Discard this process's in-memory metrics.
+    """
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def reset():
+    """Remove all stored snapshots (called when the server starts).
+    """
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+        os.remove(path)
+
+
+def collect():
+    """Return the metrics of all workers, with this process's live values.
+    """
+    own = _worker_file()
+    snapshots = [snapshot()]
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+        if path != own:
+            snapshots.append(_read(path))
+    return merge(*snapshots)
+
+
+def _format_labels(labels):
+    return ','.join('{}="{}"'.format(
+        k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in sorted(labels.items()))
+
+
+def render(data):
+    """Render metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    by_name = {}
+    for name, labels, value in data['counters']:
+        by_name.setdefault(name, []).append((labels, value))
+    for name, labels, value in data['histograms']:
+        by_name.setdefault(name, []).append((labels, value))
+    for name in sorted(by_name):
+        kind, help_text = HELP.get(name, ('untyped', ''))
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for labels, value in by_name[name]:
+            if kind != 'histogram':
+                lines.append('{}{{{}}} {}'.format(name, _format_labels(labels), value))
+                continue
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS + ('+Inf',), value):
+                cumulative += count
+                bucket_labels = dict(labels, le=bound)
+                lines.append('{}_bucket{{{}}} {}'.format(name, _format_labels(bucket_labels), cumulative))
+            lines.append('{}_sum{{{}}} {}'.format(name, _format_labels(labels), value[-2]))
+            lines.append('{}_count{{{}}} {}'.format(name, _format_labels(labels), value[-1]))
+    return '\n'.join(lines) + '\n'
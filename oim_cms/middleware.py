@@ -1,14 +1,26 @@
-from django.http import HttpResponse, HttpResponseServerError
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseNotFound, HttpResponseServerError
 from django.utils.deprecation import MiddlewareMixin
-from wagtail.core.models import Site
+from whitenoise.middleware import WhiteNoiseMiddleware
+import asyncio
+import contextvars
+import hmac
+import ipaddress
 import logging
+import time
+
+from core.sites import find_site
+from core.threads import run_in_thread
+from oim_cms import metrics
 
 
 LOGGER = logging.getLogger("healthcheck")
+BUDGET_LOGGER = logging.getLogger("cms")
 
 
 try:
-    from django.conf import settings
     XS_SHARING_ALLOWED_ORIGINS = settings.XS_SHARING_ALLOWED_ORIGINS
     XS_SHARING_ALLOWED_METHODS = settings.XS_SHARING_ALLOWED_METHODS
     XS_SHARING_ALLOWED_HEADERS = settings.XS_SHARING_ALLOWED_HEADERS
@@ -20,16 +32,100 @@ except AttributeError:
     XS_SHARING_ALLOWED_CREDENTIALS = 'true'
 
 
+def get_view_label(request):
+    """Return the label used for a request in metrics and query budgets: the
+    page template for Content pages, otherwise the resolved view name.
+    """
+    label = getattr(request, "metrics_label", None)
+    if label:
+        return label
+    if getattr(request, "resolver_match", None):
+        return request.resolver_match.view_name
+    return "unresolved"
+
+
+# The [count, seconds] of database queries made by the current request. A
+# context variable follows the request onto the threads that run its sync
+# code under ASGI, as well as working under WSGI.
+_request_queries = contextvars.ContextVar("request_queries", default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    queries = _request_queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        queries[0] += 1
+        queries[1] += time.perf_counter() - start
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder)
+
+
+class AsyncCapableMiddleware(object):
+    """Base for middleware that runs in both sync (WSGI) and async (ASGI)
+    chains: ``__call__`` hands over to ``__acall__`` when the rest of the
+    chain is async, so that requests aren't moved onto a thread here.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Marks this instance as a coroutine function to Django.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return self.handle(request)
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoise's middleware, made async-capable (in the same way as
+    AsyncCapableMiddleware) so that it doesn't force the rest of the chain
+    into sync mode under ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, **kwargs):
+        super(AsyncWhiteNoiseMiddleware, self).__init__(get_response, **kwargs)
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return super(AsyncWhiteNoiseMiddleware, self).__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            # Files are looked up on disk.
+            response = await sync_to_async(self.process_request, thread_sensitive=False)(request)
+        else:
+            response = self.process_request(request)
+        return response or await self.get_response(request)
+
+
 class SiteMiddleware(MiddlewareMixin):
 
     def process_request(self, request):
         """
         Set request.site to contain the Site object responsible for handling this request.
         """
-        try:
-            request.site = Site.find_for_request(request)
-        except Site.DoesNotExist:
-            request.site = None
+        request.site = find_site(request)
+        # Wagtail's own routing reads the site from here.
+        request._wagtail_site = request.site
 
 
 class XsSharing(object):
@@ -61,12 +157,9 @@ class XsSharing(object):
         return response
 
 
-class HealthCheckMiddleware(object):
-
-    def __init__(self, get_response):
-        self.get_response = get_response
+class HealthCheckMiddleware(AsyncCapableMiddleware):
 
-    def __call__(self, request):
+    def handle(self, request):
         if request.method == "GET":
             if request.path == "/readiness":
                 return self.readiness(request)
@@ -74,6 +167,14 @@ class HealthCheckMiddleware(object):
                 return self.liveness(request)
         return self.get_response(request)
 
+    async def __acall__(self, request):
+        if request.method == "GET":
+            if request.path == "/readiness":
+                return await run_in_thread(self.readiness, request)
+            elif request.path == "/liveness":
+                return self.liveness(request)
+        return await self.get_response(request)
+
     def liveness(self, request):
         """Returns that the server is alive.
         """
@@ -97,3 +198,87 @@ class HealthCheckMiddleware(object):
             return HttpResponseServerError("db: cannot connect to database.")
 
         return HttpResponse("OK")
+
+
+def is_metrics_allowed(request):
+    """/metrics is served to requests bearing METRICS_TOKEN, and to scrapers
+    that connect directly from a private or loopback address. Requests that
+    came through the ingress (which sets X-Forwarded-For) need the token.
+    """
+    token = settings.METRICS_TOKEN
+    if token:
+        authorization = request.META.get("HTTP_AUTHORIZATION", "")
+        if hmac.compare_digest(authorization.encode(), "Bearer {}".format(token).encode()):
+            return True
+    if "HTTP_X_FORWARDED_FOR" in request.META:
+        return False
+    try:
+        address = ipaddress.ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+    return address.is_private or address.is_loopback
+
+
+class MetricsMiddleware(AsyncCapableMiddleware):
+    """Records the latency, status and database queries of each request by
+    view (or page template), and serves the metrics aggregated across all
+    workers at /metrics (to internal scrapers only, see is_metrics_allowed).
+    """
+    def handle(self, request):
+        if request.method == "GET" and request.path == "/metrics":
+            return self.metrics_response(request)
+        queries = [0, 0.0]
+        token = _request_queries.set(queries)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+        self.record(request, response, time.perf_counter() - start, queries)
+        return response
+
+    async def __acall__(self, request):
+        if request.method == "GET" and request.path == "/metrics":
+            return self.metrics_response(request)
+        queries = [0, 0.0]
+        token = _request_queries.set(queries)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+        self.record(request, response, time.perf_counter() - start, queries)
+        return response
+
+    def metrics_response(self, request):
+        if not is_metrics_allowed(request):
+            return HttpResponseNotFound()
+        return HttpResponse(
+            metrics.render(metrics.collect()), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+    def record(self, request, response, duration, queries):
+        view = get_view_label(request)
+        metrics.observe("oim_cms_request_duration_seconds", duration, view=view)
+        metrics.inc("oim_cms_responses_total", view=view, status=response.status_code)
+        metrics.inc("oim_cms_db_queries_total", queries[0], view=view)
+        metrics.inc("oim_cms_db_query_seconds_total", queries[1], view=view)
+        metrics.write_snapshot()
+
+
+class QueryBudgetMiddleware(object):
+    """A development aid that logs requests exceeding the query budget for
+    their view (see core.testing.QUERY_BUDGETS), naming the template tag and
+    SQL pattern of any repeated queries. Enabled by QUERY_BUDGET_LOGGING.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        from core.testing import QueryBudget
+        budget = QueryBudget()
+        with budget:
+            response = self.get_response(request)
+        budget.set_label("404" if response.status_code == 404 else get_view_label(request))
+        for message in budget.violations():
+            BUDGET_LOGGER.warning("%s %s", request.path, message)
+        return response
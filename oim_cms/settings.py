@@ -2,6 +2,7 @@ from dbca_utils.utils import env
 import dj_database_url
 import os
 from pathlib import Path
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = str(Path(__file__).resolve().parents[1])
@@ -18,6 +19,8 @@ else:
 INTERNAL_IPS = ['127.0.0.1', '::1']
 ROOT_URLCONF = 'oim_cms.urls'
 WSGI_APPLICATION = 'oim_cms.wsgi.application'
+# Set by oim_cms.asgi when the application is served over ASGI.
+ASGI = env('ASGI', False)
 INSTALLED_APPS = [
     'whitenoise.runserver_nostatic',
     'django.contrib.admin',
@@ -45,8 +48,9 @@ INSTALLED_APPS = [
 ]
 MIDDLEWARE = [
     'oim_cms.middleware.HealthCheckMiddleware',
+    'oim_cms.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'oim_cms.middleware.AsyncWhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -57,6 +61,9 @@ MIDDLEWARE = [
     'wagtail.contrib.redirects.middleware.RedirectMiddleware',
     'dbca_utils.middleware.SSOLoginMiddleware',
 ]
+# Log requests that exceed their query budget (development only).
+if env('QUERY_BUDGET_LOGGING', False):
+    MIDDLEWARE.insert(2, 'oim_cms.middleware.QueryBudgetMiddleware')
 AUTHENTICATION_BACKENDS = (
     'django.contrib.auth.backends.ModelBackend',
 )
@@ -104,9 +111,8 @@ DATETIME_FORMAT = 'l d F Y, h:i A'
 
 
 # Static files configuration
-# Ensure that the media directory exists:
-if not os.path.exists(os.path.join(BASE_DIR, 'media')):
-    os.mkdir(os.path.join(BASE_DIR, 'media'))
+# The media directory is created by the warm-up stage (oim_cms.warmup) and by
+# file storage as needed, rather than on every import of the settings.
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
@@ -119,6 +125,49 @@ WHITENOISE_ROOT = STATIC_ROOT
 # Email settings
 EMAIL_HOST = env('EMAIL_HOST', 'email.host')
 EMAIL_PORT = env('EMAIL_PORT', 25)
+# Outbound email is queued in the database and sent by the send_queued_mail
+# command: N messages per SMTP connection, retried after a delay that doubles
+# with each failure (up to a maximum, in seconds) until N attempts have failed.
+MAIL_QUEUE_BATCH_SIZE = env('MAIL_QUEUE_BATCH_SIZE', 50)
+MAIL_QUEUE_RETRY_DELAY = env('MAIL_QUEUE_RETRY_DELAY', 60)
+MAIL_QUEUE_MAX_RETRY_DELAY = env('MAIL_QUEUE_MAX_RETRY_DELAY', 3600)
+MAIL_QUEUE_MAX_ATTEMPTS = env('MAIL_QUEUE_MAX_ATTEMPTS', 8)
+# A claimed batch is hidden from other workers for N seconds while it is sent.
+MAIL_QUEUE_LEASE = env('MAIL_QUEUE_LEASE', 300)
+MAIL_QUEUE_POLL_INTERVAL = env('MAIL_QUEUE_POLL_INTERVAL', 10)
+
+# Cache settings
+# The cache must be shared by every worker and pod, so that invalidation on
+# publish reaches them all. The default is a database table (created by the
+# createcachetable command), for development; production must use memcached
+# or redis (see core.checks).
+CACHE_BACKEND = env('CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': env('CACHE_LOCATION', 'oim_cms_cache'),
+        'OPTIONS': {'MAX_ENTRIES': env('CACHE_MAX_ENTRIES', 10000)},
+    }
+}
+# Seconds that a rendered page is served from cache to anonymous users (0 to
+# disable). Off by default with a per-process backend, which would serve
+# stale pages from the workers that didn't handle a publish.
+PER_PROCESS_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+RENDER_CACHE_TIMEOUT = env('RENDER_CACHE_TIMEOUT', 0 if CACHE_BACKEND in PER_PROCESS_CACHE_BACKENDS else 600)
+
+# Number of hostname:port -> Site lookups cached per worker.
+SITE_CACHE_SIZE = env('SITE_CACHE_SIZE', 256)
+
+# Metrics settings
+# Each worker writes its metrics here at most every N seconds; /metrics sums them.
+METRICS_DIR = env('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'oim_cms_metrics'))
+METRICS_WRITE_INTERVAL = env('METRICS_WRITE_INTERVAL', 5)
+# /metrics is served to direct connections from private addresses, and to
+# requests with an "Authorization: Bearer <METRICS_TOKEN>" header (if set).
+METRICS_TOKEN = env('METRICS_TOKEN', '')
 
 # Wagtail settings
 WAGTAIL_SITE_NAME = 'OIM Content Management System'
@@ -131,6 +180,27 @@ WAGTAILSEARCH_BACKENDS = {
 }
 WAGTAIL_USAGE_COUNT_ENABLED = True
 WAGTAILSEARCH_RESULTS_TEMPLATE = 'core/search_results.html'
+# Search query hits are buffered per worker and written every N seconds, or
+# sooner once this many distinct queries are waiting.
+SEARCH_HITS_FLUSH_INTERVAL = env('SEARCH_HITS_FLUSH_INTERVAL', 60)
+SEARCH_HITS_FLUSH_SIZE = env('SEARCH_HITS_FLUSH_SIZE', 200)
+SEARCH_RESULTS_PER_PAGE = env('SEARCH_RESULTS_PER_PAGE', 20)
+# 404 handling: paths that found nothing are remembered (up to N per worker),
+# and each client may trigger N fallback searches per window (seconds).
+NOT_FOUND_MATCH_CUTOFF = env('NOT_FOUND_MATCH_CUTOFF', 0.85)
+NOT_FOUND_CACHE_SIZE = env('NOT_FOUND_CACHE_SIZE', 2048)
+NOT_FOUND_SEARCH_BUDGET = env('NOT_FOUND_SEARCH_BUDGET', 10)
+NOT_FOUND_SEARCH_WINDOW = env('NOT_FOUND_SEARCH_WINDOW', 60)
+
+# Static export settings (see core.export): pages are pre-rendered by the
+# export_static management command, and optionally re-exported on publish.
+STATIC_EXPORT_ROOT = env('STATIC_EXPORT_ROOT', os.path.join(MEDIA_ROOT, 'export'))
+STATIC_EXPORT_ON_PUBLISH = env('STATIC_EXPORT_ON_PUBLISH', False)
+
+# The background worker (the run_background_tasks command) generates the
+# renditions of saved images (see core.images) and re-exports published pages
+# (with STATIC_EXPORT_ON_PUBLISH), checking for work every N seconds.
+BACKGROUND_TASKS_POLL_INTERVAL = env('BACKGROUND_TASKS_POLL_INTERVAL', 5)
 
 
 # Logging settings - log to stdout/stderr
@@ -16,8 +16,10 @@ urlpatterns = [
     path('django-admin/', admin.site.urls),
     re_path(r'^draft/(?P<path>.*)', views.draft, name='draft'),
     path('healthcheck/', views.HealthCheckView.as_view(), name='health_check'),
-    path('search', views.search, name='search'),
-    path('redirect/', views.redirect, name='redirect'),
+    # Search and redirects are only async when served over ASGI; under WSGI
+    # that would just add an event loop and a thread hop to every request.
+    path('search', views.async_search if settings.ASGI else views.search, name='search'),
+    path('redirect/', views.async_redirect if settings.ASGI else views.redirect, name='redirect'),
     path('', include(wagtail_urls)),
 ]
 
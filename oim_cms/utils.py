@@ -1,27 +1,173 @@
-from django.http import HttpResponse
-from djqscsv import render_to_csv_response
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, StreamingHttpResponse
+from djqscsv import generate_filename
 from restless.dj import DjangoResource
+import csv
+import datetime
+import functools
+import io
+import json
+import logging
+import operator
+
+
+LOGGER = logging.getLogger('cms')
+
+
+def get_values_queryset(queryset, field_order=None):
+    """Return a values queryset and its field names for an export, with the
+    fields in ``field_order`` first (as djqscsv orders them).
+    """
+    iterable_class = getattr(queryset, '_iterable_class', object)
+    values_qs = queryset if iterable_class.__name__ == 'ValuesIterable' else queryset.values()
+    query = values_qs.query
+    field_names = [*query.values_select, *query.extra_select, *query.annotation_select]
+    if field_order:
+        ordered = [field for field in field_order if field in field_names]
+        field_names = ordered + [field for field in field_names if field not in field_order]
+    return values_qs, field_names
+
+
+def serialize_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def iter_csv(queryset, field_order=None, chunk_size=2000):
+    """Yield a CSV export of a queryset in chunks of ``chunk_size`` rows, in
+    the same format as djqscsv: a BOM, then a header of verbose field names.
+    """
+    values_qs, field_names = get_values_queryset(queryset, field_order)
+    headers = dict((field.name, field.verbose_name) for field in queryset.model._meta.fields)
+    buffer = io.StringIO()
+    buffer.write('\ufeff')  # For Excel, as djqscsv does.
+    writer = csv.writer(buffer)
+    writer.writerow([headers.get(field, field) for field in field_names])
+    # iterator() fetches rows in chunks (through a server-side cursor on
+    # PostgreSQL) without caching them on the queryset.
+    for i, record in enumerate(values_qs.iterator(chunk_size=chunk_size), 1):
+        writer.writerow([serialize_value(record[field]) for field in field_names])
+        if i % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_jsonl(queryset, field_order=None, chunk_size=2000):
+    """Yield a JSON lines export of a queryset (one object per row, with keys
+    in field order) in chunks of ``chunk_size`` rows.
+    """
+    values_qs, field_names = get_values_queryset(queryset, field_order)
+    lines = []
+    for record in values_qs.iterator(chunk_size=chunk_size):
+        lines.append(json.dumps(dict((field, record[field]) for field in field_names), cls=DjangoJSONEncoder))
+        if len(lines) == chunk_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
 
 
 class CSVDjangoResource(DjangoResource):
-    """Extend the restless DjangoResource class to add a CSV export endpoint.
+    """Extend the restless DjangoResource class to add CSV and JSON lines
+    export endpoints. Exports are streamed, so memory use is bounded by
+    EXPORT_CHUNK_SIZE rows however large the queryset.
     """
+    EXPORT_CHUNK_SIZE = 2000
+    EXPORT_FORMATS = {
+        'csv': (iter_csv, 'text/csv', 'csv'),
+        'jsonl': (iter_jsonl, 'application/x-ndjson', 'jsonl'),
+    }
+
     @classmethod
-    def as_csv(self, request):
+    def as_export(self, request, output_format='csv'):
         resource = self()
         if not hasattr(resource, "list_qs"):
             return HttpResponse(
                 "list_qs not implemented for {}".format(self.__name__))
         resource.request = request
-        return render_to_csv_response(
-            resource.list_qs(), field_order=resource.VALUES_ARGS)
+        queryset = resource.list_qs()
+        iter_export, content_type, extension = self.EXPORT_FORMATS[output_format]
+        response = StreamingHttpResponse(
+            iter_export(queryset, getattr(resource, "VALUES_ARGS", None), self.EXPORT_CHUNK_SIZE),
+            content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename={}.{};'.format(
+            generate_filename(queryset)[:-len('.csv')], extension)
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    @classmethod
+    def as_csv(self, request):
+        return self.as_export(request, 'csv')
+
+    @classmethod
+    def as_jsonl(self, request):
+        return self.as_export(request, 'jsonl')
+
+
+# Getter and setter for each type traversed by a lookup: dictionary-alikes
+# are indexed, anything else is accessed by attribute.
+_strategies = {}
+
+
+def get_strategy(cls):
+    strategy = _strategies.get(cls)
+    if strategy is None:
+        if hasattr(cls, 'keys') and hasattr(cls, '__getitem__'):
+            strategy = (operator.getitem, operator.setitem)
+        else:
+            strategy = (getattr, setattr)
+        _strategies[cls] = strategy
+    return strategy
+
+
+class AccessorPlan(object):
+    """A formatter lookup compiled once: the dotted path is split ahead of
+    time, and the getter/setter for each step is resolved per type.
+    """
+    __slots__ = ('lookup', 'parents', 'key', 'formatter')
+
+    def __init__(self, lookup, formatter):
+        parts = lookup.split('.')
+        if len(parts) > 1 and not parts[-1]:
+            # A trailing dot is ignored ("a." formats "a"), as it always was.
+            parts.pop()
+        self.lookup = lookup
+        self.parents = parts[:-1]
+        self.key = parts[-1]
+        self.formatter = formatter
+
+    def apply(self, request, data):
+        """Replace the value at the end of the lookup with its formatted value
+        and return ``data`` (or for an empty lookup, the formatted data).
+        """
+        if not self.key:
+            return self.formatter(request, data)
+        target = data
+        for part in self.parents:
+            target = (_strategies.get(type(target)) or get_strategy(type(target)))[0](target, part)
+        getter, setter = _strategies.get(type(target)) or get_strategy(type(target))
+        setter(target, self.key, self.formatter(request, getter(target, self.key)))
+        return data
+
+
+@functools.lru_cache(maxsize=128)
+def compile_plans(formatters):
+    """Return the accessor plans for a formatter config, given as a tuple of
+    (lookup, formatter) pairs. Plans are shared by every formatter with the
+    same config.
+    """
+    return tuple(AccessorPlan(lookup, formatter) for lookup, formatter in formatters if formatter)
 
 
 class FieldsFormatter(object):
     """
     A formatter object to format specified fields with a configured formatter
     object. This takes a
-        ``request`` parameter , a http request object
         ``formatters`` parameter: a dictionary of keys (a dotted lookup path to
         the desired attribute/key on the object) and values(a formatter object).
 
@@ -30,6 +176,12 @@ class FieldsFormatter(object):
 
     This method will replace the old value with formatted value.
 
+    Lookups are compiled once into accessor plans. Values that can't be found
+    or formatted are left as they are, and the failures of each call are
+    collected (as (row index, lookup, exception)) and logged. A formatter is
+    shared by every request (and thread) using its resource, so it keeps no
+    per-call state.
+
     Example::
         preparer = FieldsFormatter(request, fields={
             # ``user`` is the key the client will see.
@@ -41,54 +193,61 @@ class FieldsFormatter(object):
     def __init__(self, formatters):
         super(FieldsFormatter, self).__init__()
         self._formatters = formatters
+        try:
+            self._plans = compile_plans(tuple(formatters.items()) if formatters else ())
+        except TypeError:
+            # Unhashable formatters can't be shared, so compile them here.
+            self._plans = compile_plans.__wrapped__(tuple(formatters.items()))
 
     def format(self, request, data):
         """
         format data with configured formatter object
         data can be a list or a single object
         """
+        errors = []
         if data:
             if isinstance(data, list):
-                # list object
-                for row in data:
-                    self.format_object(request, row)
+                # list object: a single pass over the rows
+                for index, row in enumerate(data):
+                    self.apply_plans(request, row, errors, index)
             else:
                 # a single object
-                self.format_object(request, data)
+                self.apply_plans(request, data, errors)
+            self.report_errors(errors)
 
         return data
 
-    def format_object(self, request, data):
-        """
-        format a simgle object.
-
-        Uses the ``lookup_data`` method to traverse dotted paths.
+    def apply_plans(self, request, data, errors, index=None):
+        for plan in self._plans:
+            try:
+                data = plan.apply(request, data)
+            except Exception as e:
+                errors.append((index, plan.lookup, e))
+        return data
 
-        Replace the value with formatted value, if required.
+    def report_errors(self, errors):
+        failures = {}
+        for index, lookup, e in errors:
+            failures.setdefault(lookup, []).append(e)
+        for lookup, exceptions in failures.items():
+            LOGGER.warning(
+                'FieldsFormatter left %s value(s) of %r unformatted, e.g. %r', len(exceptions), lookup, exceptions[0])
 
+    def format_object(self, request, data):
         """
-        if not self._formatters:
-            # No fields specified. Serialize everything.
-            return data
-
-        for lookup, formatter in self._formatters.items():
-            if not formatter:
-                continue
-            data = self.format_data(request, lookup, data, formatter)
-
+        format a single object, replacing values with their formatted
+        values, and return it.
+        """
+        errors = []
+        data = self.apply_plans(request, data, errors)
+        self.report_errors(errors)
         return data
 
     def format_data(self, request, lookup, data, formatter):
         """
-        Given a lookup string, attempts to descend through nested data looking for
-        the value ,format the value and then replace the old value with formatted value.
-
-        Can work with either dictionary-alikes or objects (or any combination of
-        those).
-
-        Lookups should be a string. If it is a dotted path, it will be split on
-        ``.`` & it will traverse through to find the final value. If not, it will
-        simply attempt to find either a key or attribute of that name & return it.
+        Given a lookup string, descend through nested data (dictionary-alikes
+        or objects, or any combination of those) to find the value, and
+        replace it with its formatted value.
 
         Example::
 
@@ -103,49 +262,17 @@ class FieldsFormatter(object):
             ...         name='daniel'
             ...     )
             ... }
-            >>> lookup_data('type', data)
-            'message'
-            >>> lookup_data('greeting.en', data)
-            'hello'
-            >>> lookup_data('person.name', data)
-            'daniel'
+            >>> upper = lambda request, value: value.upper()
+            >>> data = FieldsFormatter({}).format_data(request, 'greeting.en', data, upper)
+            >>> data['greeting']['en']
+            'HELLO'
+            >>> data = FieldsFormatter({}).format_data(request, 'person.name', data, upper)
+            >>> data['person'].name
+            'DANIEL'
 
         """
-        parts = lookup.split('.')
-
-        if not parts or not parts[0]:
-            return formatter(request, data)
-
-        part = parts[0]
-        remaining_lookup = '.'.join(parts[1:])
-
-        if hasattr(data, 'keys') and hasattr(data, '__getitem__'):
-            # Dictionary enough for us.
-            try:
-                value = data[part]
-                if remaining_lookup:
-                    # is an object
-                    self.format_data(
-                        request, remaining_lookup, value, formatter)
-                else:
-                    # is a simple type value
-                    data[part] = formatter(request, value)
-            except:
-                # format failed, ignore
-                pass
-        else:
-            try:
-                value = getattr(data, part)
-                # Assume it's an object.
-                if remaining_lookup:
-                    # is an object
-                    self.format_data(
-                        request, remaining_lookup, value, formatter)
-                else:
-                    # is a simple type value
-                    setattr(data, part, formatter(request, value))
-            except:
-                # format failed, ignore
-                pass
-
-        return data
+        try:
+            return AccessorPlan(lookup, formatter).apply(request, data)
+        except Exception as e:
+            LOGGER.warning('FieldsFormatter left %r unformatted: %r', lookup, e)
+            return data
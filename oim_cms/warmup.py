@@ -0,0 +1,118 @@
+"""
+Warm-up of a freshly loaded application, run in the gunicorn master before
+workers are forked (see gunicorn.py) so that every worker, including those
+started after a recycle, inherits the results instead of paying for them on
+its first requests.
+"""
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.template import TemplateSyntaxError
+from django.template.loader import get_template
+from django.test import RequestFactory
+from django.urls import get_resolver
+from wagtail.core.models import Site
+from wagtail.core.rich_text import expand_db_html
+import logging
+import os
+import time
+
+from core.navigation import get_menu_tree
+from core.not_found import get_slug_index
+from core.page_urls import prime_url_map
+from core.sites import find_site
+from oim_cms import metrics
+
+
+LOGGER = logging.getLogger('cms')
+
+
+def get_project_templates():
+    """Yield the names of the templates of the project's own apps.
+    """
+    for app_config in apps.get_app_configs():
+        if not app_config.path.startswith(settings.BASE_DIR) or 'site-packages' in app_config.path:
+            continue
+        template_dir = os.path.join(app_config.path, 'templates')
+        for dirpath, dirnames, filenames in os.walk(template_dir):
+            for filename in sorted(filenames):
+                if filename.endswith(('.html', '.txt')):
+                    yield os.path.relpath(os.path.join(dirpath, filename), template_dir).replace(os.sep, '/')
+
+
+def compile_templates():
+    """Compile the project's templates (held by the cached template loader
+    when DEBUG is off), importing the template tag libraries they load.
+    """
+    count = 0
+    for name in get_project_templates():
+        try:
+            get_template(name)
+            count += 1
+        except TemplateSyntaxError as e:
+            LOGGER.warning('Could not compile template %s: %s', name, e)
+    return count
+
+
+def prime_urls():
+    # Building the reverse lookup tables imports every URLconf and view module.
+    return len(get_resolver().reverse_dict)
+
+
+def prime_rich_text():
+    # Scans the rich text feature hooks and builds Wagtail's rewriter.
+    expand_db_html('')
+
+
+def prime_sites():
+    """Resolve each site's hostname and build its menu tree.
+    """
+    sites = list(Site.objects.all())
+    for site in sites:
+        request = RequestFactory().get('/', HTTP_HOST=site.hostname, SERVER_PORT=site.port)
+        try:
+            request.site = find_site(request)
+        except Exception as e:
+            # Typically a hostname missing from ALLOWED_HOSTS.
+            LOGGER.warning('Could not prime site %s: %s', site, e)
+            continue
+        get_menu_tree(request)
+    return len(sites)
+
+
+def ensure_media_root():
+    os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
+
+
+STAGES = (
+    ('media', ensure_media_root),
+    ('urls', prime_urls),
+    ('templates', compile_templates),
+    ('rich_text', prime_rich_text),
+    ('sites', prime_sites),
+    ('page_urls', prime_url_map),
+    ('slug_index', get_slug_index),
+)
+
+
+def warm_up():
+    """Run each warm-up stage, returning a list of (stage, seconds).
+
+    Database and cache connections opened along the way are closed, as they
+    must not be shared with forked workers, and metrics recorded are
+    discarded so that workers don't each report them.
+    """
+    timings = []
+    for name, stage in STAGES:
+        started = time.perf_counter()
+        try:
+            stage()
+        except Exception:
+            LOGGER.exception('Warm-up stage %s failed', name)
+        timings.append((name, time.perf_counter() - started))
+    connections.close_all()
+    for cache in caches.all():
+        cache.close()
+    metrics.clear()
+    return timings